@@ -7,10 +7,12 @@ Date: 2025-10-25
 """
 
 import os
+import io
 import time
+import queue
 import threading
 from datetime import datetime
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFont
 try:
     from picamera import PiCamera
     CAMERA_AVAILABLE = True
@@ -18,7 +20,15 @@ except ImportError:
     print("⚠️ PiCamera not available - using mock camera for testing")
     CAMERA_AVAILABLE = False
 
-from photo_uploader import PhotoUploader
+try:
+    import numpy as np
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError):
+    # PyTurboJPEG or libturbojpeg missing - fall back to PIL encoder
+    turbo_jpeg = None
+
+from photo_uploader import PhotoUploader, PHOTO_EXTENSIONS
 from config import Config
 
 class MockCamera:
@@ -31,25 +41,64 @@ class MockCamera:
         self.awb_mode = 'auto'
         self.meter_mode = 'average'
         self.image_effect = 'none'
+        
+        # Static test pattern per capture size, only the time is stamped per call
+        self._templates = {}
+        self._font = ImageFont.load_default()
+    
+    def _get_template(self, size):
+        """Get cached background + border + label for a capture size"""
+        template = self._templates.get(size)
+        if template is None:
+            template = Image.new('RGB', size, color=(100, 150, 200))
+            draw = ImageDraw.Draw(template)
+            draw.rectangle([10, 10, size[0]-10, size[1]-10], outline=(255, 255, 255))
+            draw.text((20, 20), "TEST CAMERA", fill=(255, 255, 255), font=self._font)
+            self._templates[size] = template
+        return template
+    
+    def _encode_jpeg(self, img, quality):
+        """Encode JPEG with libjpeg-turbo when available"""
+        if turbo_jpeg:
+            return turbo_jpeg.encode(np.asarray(img), quality=quality, pixel_format=TJPF_RGB)
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=quality)
+        return buf.getvalue()
     
-    def capture(self, filepath, **kwargs):
-        """Create a test image"""
-        if 'resize' in kwargs:
-            size = kwargs['resize']
+    def capture(self, output, format=None, **kwargs):
+        """Create a test image (file path or writable RGB buffer)"""
+        if kwargs.get('resize'):
+            size = tuple(kwargs['resize'])
         else:
             size = (640, 480)
         
-        img = Image.new('RGB', size, color=(100, 150, 200))
+        # Add timestamp to the test pattern
+        img = self._get_template(size).copy()
+        ImageDraw.Draw(img).text((20, 40), datetime.now().strftime("%H:%M:%S"),
+                                 fill=(255, 255, 0), font=self._font)
         
-        # Add some test pattern
-        from PIL import ImageDraw
-        draw = ImageDraw.Draw(img)
-        draw.rectangle([10, 10, size[0]-10, size[1]-10], outline=(255, 255, 255))
-        draw.text((20, 20), "TEST CAMERA", fill=(255, 255, 255))
-        draw.text((20, 40), datetime.now().strftime("%H:%M:%S"), fill=(255, 255, 0))
-        
-        img.save(filepath)
-        print(f"📷 Mock photo saved: {filepath}")
+        quality = kwargs.get('quality', 85)
+        if isinstance(output, str):
+            if output.lower().endswith(('.jpg', '.jpeg')):
+                with open(output, 'wb') as f:
+                    f.write(self._encode_jpeg(img, quality))
+            else:
+                img.save(output)
+            print(f"📷 Mock photo saved: {output}")
+        elif format == 'jpeg':
+            output.write(self._encode_jpeg(img, quality))
+        elif hasattr(output, 'write'):
+            # Raw RGB into caller's stream, like picamera format='rgb'
+            output.write(img.tobytes())
+        else:
+            memoryview(output)[:] = img.tobytes()
+    
+    def capture_continuous(self, output, format=None, **kwargs):
+        """Yield test frames into the same output until closed"""
+        while not self.closed:
+            self.capture(output, format, **kwargs)
+            yield output
+            time.sleep(1.0 / self.framerate)
     
     def close(self):
         self.closed = True
@@ -69,6 +118,14 @@ class CameraApp:
         self.camera_ready = False
         self.preview_active = False
         
+        # Preview capture thread (keeps only the newest frame)
+        self.preview_size = (128, 128)
+        self._preview_frames = queue.Queue(maxsize=1)
+        self._preview_thread = None
+        self._preview_running = False
+        self._preview_error = None
+        self._last_preview = None
+        
         # App state
         self.running = False
         self.show_ui = True
@@ -81,9 +138,26 @@ class CameraApp:
         self.show_focus_indicator = False
         self.focus_x, self.focus_y = 64, 64
         
+        # Timed overlays drawn by run_frame: [start, until, draw callable]
+        self._overlays = []
+        self._flash_until = 0
+        
+        # Pre-rendered UI bars (top bar keyed by mode/count/pending)
+        self._top_bar_cache = (None, None)
+        self._bottom_bar = None
+        
         # Create photos directory
         os.makedirs(self.config.PHOTOS_DIR, exist_ok=True)
         
+        # Photo count: one directory scan at startup, then kept incrementally
+        # as the save worker writes photos (on_launch doesn't rescan)
+        self.update_photo_count()
+        
+        # Background writer so the SD card write doesn't block the UI
+        self._save_queue = queue.Queue()
+        self._save_thread = threading.Thread(target=self._save_worker, daemon=True)
+        self._save_thread.start()
+        
         # Initialize camera
         self.init_camera()
         
@@ -125,30 +199,93 @@ class CameraApp:
         self.show_ui = True
         self.ui_timeout = time.time() + 5  # Hide UI after 5 seconds
         
-        # Update photo count
-        self.update_photo_count()
+        self.start_preview_stream()
     
     def on_exit(self):
         """Called when exiting camera app"""
         print("📷 Camera app exiting")
         self.running = False
         self.preview_active = False
+        self.stop_preview_stream()
+    
+    def start_preview_stream(self):
+        """Start background preview capture thread"""
+        if self._preview_thread is None and self.camera_ready:
+            self._preview_running = True
+            self._preview_error = None
+            self._preview_thread = threading.Thread(target=self._preview_worker, daemon=True)
+            self._preview_thread.start()
+    
+    def stop_preview_stream(self):
+        """Stop preview capture thread and release the video port"""
+        self._preview_running = False
+        if self._preview_thread is not None:
+            if self._preview_thread.is_alive():
+                self._preview_thread.join(timeout=2)
+            self._preview_thread = None
+    
+    def _preview_worker(self):
+        """Capture preview frames while the main loop draws and updates the display"""
+        frame_io = io.BytesIO()
+        stream = None
+        
+        while self._preview_running:
+            try:
+                # Persistent video-port stream (raw RGB, no JPEG)
+                if stream is None:
+                    stream = self.camera.capture_continuous(
+                        frame_io, format='rgb', resize=self.preview_size, use_video_port=True)
+                next(stream)
+                
+                with frame_io.getbuffer() as frame:
+                    preview_img = Image.frombytes('RGB', self.preview_size, frame)
+                frame_io.seek(0)
+                frame_io.truncate()
+                
+                # Drop the stale frame so the display always gets the newest
+                try:
+                    self._preview_frames.get_nowait()
+                except queue.Empty:
+                    pass
+                self._preview_frames.put_nowait(preview_img)
+                self._preview_error = None
+                
+            except Exception as e:
+                self._preview_error = e
+                if stream is not None:
+                    stream.close()
+                    stream = None
+                frame_io.seek(0)
+                frame_io.truncate()
+                time.sleep(1)
+        
+        if stream is not None:
+            stream.close()
     
     def run_frame(self):
         """Update camera app (called every frame)"""
         if not self.running:
             return False
         
+        now = time.time()
+        
         # Update camera preview
         if self.preview_active and self.camera_ready:
             self.update_preview()
         
+        if now < self._flash_until:
+            # Shutter flash covers everything, sent straight to the panel
+            self.display.fill_color_fast((255, 255, 255))
+            return True
+        
         # Draw UI overlay
-        if self.show_ui or time.time() < self.ui_timeout:
+        if self.show_ui or now < self.ui_timeout:
             self.draw_camera_ui()
         
+        self.draw_overlays(now)
+        
         # Auto-hide UI
-        if time.time() > self.ui_timeout:
+        if now > self.ui_timeout:
             self.show_ui = False
         
         self.display.update()
@@ -180,26 +317,23 @@ class CameraApp:
     
     def update_preview(self):
         """Update camera preview on display"""
-        try:
-            # Capture small preview image
-            preview_path = "/tmp/camera_preview.jpg"
-            
-            if CAMERA_AVAILABLE and self.camera and not getattr(self.camera, 'closed', False):
-                self.camera.capture(preview_path, resize=(128, 128), use_video_port=True)
-            else:
-                # Create mock preview
-                self.camera.capture(preview_path, resize=(128, 128))
-            
-            # Load and display preview
-            preview_img = Image.open(preview_path)
-            self.display.display_image(preview_img, x=0, y=0)
-            
-        except Exception as e:
+        if self._preview_error is not None:
             # Show error instead of preview
+            e = self._preview_error
             self.display.clear((50, 50, 50))
             self.display.draw_text("Camera Error", 25, 55, color=(255, 100, 100), size=12)
             error_msg = str(e)[:20] + "..." if len(str(e)) > 20 else str(e)
             self.display.draw_text(error_msg, 10, 75, color=(255, 150, 150), size=8)
+            return
+        
+        # Newest frame from the capture thread, or repeat the last one
+        try:
+            self._last_preview = self._preview_frames.get_nowait()
+        except queue.Empty:
+            pass
+        
+        if self._last_preview is not None:
+            self.display.display_image(self._last_preview, x=0, y=0)
     
     def take_photo(self):
         """Capture and save photo"""
@@ -224,20 +358,15 @@ class CameraApp:
             # Show capture feedback
             self.show_capture_feedback()
             
-            # Capture photo at full resolution
-            if CAMERA_AVAILABLE and self.camera and not getattr(self.camera, 'closed', False):
-                self.camera.capture(filepath, quality=self.config.PHOTO_QUALITY)
-            else:
-                # Mock capture
-                self.camera.capture(filepath)
+            # Capture photo at full resolution into memory
+            photo_buf = io.BytesIO()
+            self.camera.capture(photo_buf, format='jpeg', quality=self.config.PHOTO_QUALITY)
+            self.show_capture_indicator()
             
             print(f"📸 Photo captured: {filename}")
             
-            # Update photo count
-            self.photo_count += 1
-            
-            # Queue for upload to network share
-            self.uploader.queue_photo(filepath)
+            # Write to disk and queue for upload in the background
+            self._save_queue.put((filepath, photo_buf))
             
             # Show success confirmation
             self.show_capture_confirmation(filename)
@@ -247,34 +376,75 @@ class CameraApp:
             error_msg = str(e)[:20] + "..." if len(str(e)) > 20 else str(e)
             self.show_error_message(f"Capture failed: {error_msg}")
     
+    def _save_worker(self):
+        """Write captured photos to disk and queue them for the network share"""
+        while True:
+            item = self._save_queue.get()
+            if item is None:
+                break
+            
+            filepath, photo_buf = item
+            try:
+                with open(filepath, 'wb') as f:
+                    f.write(photo_buf.getbuffer())
+                
+                # Update photo count (only photos that actually reached the disk)
+                self.photo_count += 1
+                
+                # Queue for upload to network share
+                self.uploader.queue_photo(filepath)
+            except Exception as e:
+                print(f"❌ Photo save failed: {e}")
+    
+    def show_overlay(self, draw, duration, delay=0):
+        """Draw an overlay on top of the preview for a while (non-blocking)"""
+        start = time.time() + delay
+        self._overlays.append([start, start + duration, draw])
+    
+    def draw_overlays(self, now):
+        """Draw active overlays and drop expired ones"""
+        self._overlays = [overlay for overlay in self._overlays if now < overlay[1]]
+        for start, until, draw in self._overlays:
+            if now >= start:
+                draw()
+    
     def show_capture_feedback(self):
-        """Show immediate capture feedback"""
-        # Flash effect
-        self.display.flash_screen(color=(255, 255, 255), duration=0.1)
-        
-        # Show capture indicator
+        """Show immediate capture feedback (before the blocking capture)"""
+        # Flash effect: sent to the panel now so it is up while capture() blocks;
+        # run_frame keeps it for at least 0.1 s if the capture is quicker
+        self.display.fill_color_fast((255, 255, 255))
+        self._flash_until = time.time() + 0.1
+    
+    def show_capture_indicator(self):
+        """Show capture indicator after the flash (once capture() has returned)"""
+        delay = max(0.0, self._flash_until - time.time())
+        self.show_overlay(self._draw_capture_indicator, 0.2, delay=delay)
+    
+    def _draw_capture_indicator(self):
         self.display.draw_circle(64, 64, 20, color=(255, 255, 255))
         self.display.draw_text("📸", 55, 55, color=(0, 0, 0), size=16)
-        self.display.update()
-        time.sleep(0.2)
     
     def show_capture_confirmation(self, filename):
         """Show photo saved confirmation"""
-        # Semi-transparent overlay
-        self.display.draw_rectangle(10, 50, 108, 30, color=(0, 0, 0), outline=(0, 255, 0))
-        self.display.draw_text("Saved to Share!", 20, 58, color=(0, 255, 0), size=12)
         display_name = filename[:15] + "..." if len(filename) > 15 else filename
-        self.display.draw_text(display_name, 15, 70, color=(200, 255, 200), size=8)
-        self.display.update()
-        time.sleep(1.5)
+        
+        def draw():
+            # Semi-transparent overlay
+            self.display.draw_rectangle(10, 50, 108, 30, color=(0, 0, 0), outline=(0, 255, 0))
+            self.display.draw_text("Saved to Share!", 20, 58, color=(0, 255, 0), size=12)
+            self.display.draw_text(display_name, 15, 70, color=(200, 255, 200), size=8)
+        
+        # Shown once the capture indicator is done
+        self.show_overlay(draw, 1.5, delay=0.3)
     
     def show_error_message(self, message):
         """Show error message overlay"""
-        self.display.draw_rectangle(10, 50, 108, 30, color=(0, 0, 0), outline=(255, 0, 0))
-        self.display.draw_text("Error", 50, 58, color=(255, 0, 0), size=12)
-        self.display.draw_text(message, 15, 70, color=(255, 200, 200), size=8)
-        self.display.update()
-        time.sleep(2)
+        def draw():
+            self.display.draw_rectangle(10, 50, 108, 30, color=(0, 0, 0), outline=(255, 0, 0))
+            self.display.draw_text("Error", 50, 58, color=(255, 0, 0), size=12)
+            self.display.draw_text(message, 15, 70, color=(255, 200, 200), size=8)
+        
+        self.show_overlay(draw, 2)
     
     def toggle_ui(self):
         """Toggle UI overlay visibility"""
@@ -291,10 +461,13 @@ class CameraApp:
         self.capture_mode = modes[new_index]
         
         # Show mode change
-        self.display.draw_rectangle(20, 45, 88, 20, color=(0, 0, 0), outline=(100, 150, 255))
-        self.display.draw_text(f"Mode: {self.capture_mode.title()}", 30, 52, color=(255, 255, 255), size=12)
-        self.display.update()
-        time.sleep(1)
+        mode_text = f"Mode: {self.capture_mode.title()}"
+        
+        def draw():
+            self.display.draw_rectangle(20, 45, 88, 20, color=(0, 0, 0), outline=(100, 150, 255))
+            self.display.draw_text(mode_text, 30, 52, color=(255, 255, 255), size=12)
+        
+        self.show_overlay(draw, 1)
         
         print(f"📷 Capture mode: {self.capture_mode}")
     
@@ -303,41 +476,60 @@ class CameraApp:
         if not self.show_ui:
             return
         
+        # Top bar changes only with mode, photo count or upload queue
+        upload_status = self.uploader.get_upload_status()
+        key = (self.capture_mode, self.photo_count, upload_status['pending'])
+        cached_key, top_bar = self._top_bar_cache
+        if cached_key != key:
+            top_bar = self.display.render_sprite(128, 23, lambda: self._draw_top_bar(*key))
+            self._top_bar_cache = (key, top_bar)
+        self.display.display_image(top_bar, 0, 0)
+        
+        # Time is the only per-frame text
+        current_time = datetime.now().strftime("%H:%M:%S")
+        self.display.draw_text(current_time, 5, 5, color=(255, 255, 255), size=10)
+        
+        # Bottom bar is fully static
+        if self._bottom_bar is None:
+            self._bottom_bar = self.display.render_sprite(128, 22, self._draw_bottom_bar)
+        self.display.display_image(self._bottom_bar, 0, 106)
+    
+    def _draw_top_bar(self, mode, photo_count, pending):
+        """Render top bar contents (without the clock)"""
         # Semi-transparent top bar
         self.display.draw_rectangle(0, 0, 128, 22, color=(0, 0, 0))
         
-        # Time and mode
-        current_time = datetime.now().strftime("%H:%M:%S")
-        self.display.draw_text(current_time, 5, 5, color=(255, 255, 255), size=10)
-        self.display.draw_text(self.capture_mode.upper(), 70, 5, color=(255, 255, 0), size=10)
+        # Mode
+        self.display.draw_text(mode.upper(), 70, 5, color=(255, 255, 0), size=10)
         
         # Photo count
-        self.display.draw_text(f"📷{self.photo_count}", 5, 12, color=(200, 200, 200), size=8)
+        self.display.draw_text(f"📷{photo_count}", 5, 12, color=(200, 200, 200), size=8)
         
         # Upload status - show share status instead of WiFi
-        upload_status = self.uploader.get_upload_status()
-        if upload_status['pending'] > 0:
-            self.display.draw_text(f"⬆{upload_status['pending']}", 90, 12, color=(255, 255, 0), size=8)
+        if pending > 0:
+            self.display.draw_text(f"⬆{pending}", 90, 12, color=(255, 255, 0), size=8)
         else:
             self.display.draw_text("📁", 100, 12, color=(0, 255, 0), size=8)  # Share icon
-        
+    
+    def _draw_bottom_bar(self):
+        """Render bottom bar (coordinates relative to y=106)"""
         # Semi-transparent bottom bar
-        self.display.draw_rectangle(0, 106, 128, 22, color=(0, 0, 0))
+        self.display.draw_rectangle(0, 0, 128, 22, color=(0, 0, 0))
         
         # Control hints
-        self.display.draw_text("● Photo", 5, 110, color=(255, 255, 255), size=8)
-        self.display.draw_text("▲ Exit", 50, 110, color=(200, 200, 200), size=8)
-        self.display.draw_text("▼ UI", 85, 110, color=(200, 200, 200), size=8)
+        self.display.draw_text("● Photo", 5, 4, color=(255, 255, 255), size=8)
+        self.display.draw_text("▲ Exit", 50, 4, color=(200, 200, 200), size=8)
+        self.display.draw_text("▼ UI", 85, 4, color=(200, 200, 200), size=8)
         
         # Mode switching hints
-        self.display.draw_text("◄ ► Mode", 30, 118, color=(150, 150, 150), size=7)
+        self.display.draw_text("◄ ► Mode", 30, 12, color=(150, 150, 150), size=7)
     
     def update_photo_count(self):
-        """Update photo count from filesystem"""
+        """Recount photos from filesystem"""
         try:
-            photos = [f for f in os.listdir(self.config.PHOTOS_DIR) 
-                     if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            self.photo_count = len(photos)
+            with os.scandir(self.config.PHOTOS_DIR) as entries:
+                self.photo_count = sum(1 for entry in entries
+                                       if entry.name.lower().endswith(PHOTO_EXTENSIONS))
         except Exception as e:
             print(f"⚠️ Error counting photos: {e}")
             self.photo_count = 0
@@ -351,6 +543,7 @@ class CameraApp:
         print("🧹 Cleaning up camera app...")
         self.running = False
         self.preview_active = False
+        self.stop_preview_stream()
         
         if self.camera and hasattr(self.camera, 'close') and not getattr(self.camera, 'closed', False):
             try:
@@ -359,5 +552,10 @@ class CameraApp:
             except Exception as e:
                 print(f"⚠️ Camera cleanup error: {e}")
         
+        # Finish writing captured photos before the uploader stops
+        self._save_queue.put(None)
+        if self._save_thread.is_alive():
+            self._save_thread.join(timeout=10)
+        
         if hasattr(self, 'uploader'):
             self.uploader.cleanup()
\ No newline at end of file
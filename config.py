@@ -8,9 +8,14 @@ Date: 2025-10-25
 
 import os
 import json
+import atexit
+import threading
 from datetime import datetime
 
 class Config:
+    # Delay before a set() is written, so bursts of changes share one write
+    SAVE_DELAY = 1.0
+    
     def __init__(self):
         # Base directories
         self.BASE_DIR = os.path.expanduser("~/camera")
@@ -70,12 +75,15 @@ class Config:
             "SHUTDOWN_SOUND": True              # Play shutdown sound
         }
         
+        # Deferred saving state (the lock also guards writes of the file)
+        self._save_lock = threading.RLock()
+        self._save_timer = None
+        self._dirty = False
+        atexit.register(self.flush)
+        
         # Load configuration
         self.config = self.load_config()
         
-        # Set attributes for easy access
-        self.set_attributes()
-        
         print(f"⚙️ Configuration loaded from {self.CONFIG_FILE}")
     
     def ensure_directories(self):
@@ -103,27 +111,54 @@ class Config:
             return self.default_config.copy()
     
     def save_config(self, config=None):
-        """Save configuration to file"""
+        """Save configuration to file atomically, returns True on success"""
         try:
             config_to_save = config or self.config
-            with open(self.CONFIG_FILE, 'w') as f:
-                json.dump(config_to_save, f, indent=4)
+            tmp_file = self.CONFIG_FILE + ".tmp"
+            # One writer at a time: they all share the temp file
+            with self._save_lock:
+                with open(tmp_file, 'w') as f:
+                    json.dump(config_to_save, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.CONFIG_FILE)
             print(f"💾 Configuration saved to {self.CONFIG_FILE}")
+            return True
         except Exception as e:
             print(f"❌ Error saving config: {e}")
+            return False
     
-    def set_attributes(self):
-        """Set configuration values as object attributes"""
-        for key, value in self.config.items():
-            setattr(self, key, value)
+    def __getattr__(self, key):
+        """Expose configuration values as attributes (e.g. config.PHOTO_QUALITY)"""
+        config = self.__dict__.get('config')
+        if config is not None and key in config:
+            return config[key]
+        raise AttributeError(f"'Config' object has no attribute '{key}'")
     
     def get(self, key, default=None):
         """Get configuration value"""
         return self.config.get(key, default)
     
     def set(self, key, value, save=True):
-        """Set configuration value"""
-        self.config[key] = value
-        setattr(self, key, value)
-        if save:
-            self.save_config()
\ No newline at end of file
+        """Set configuration value (saved shortly after, see flush())"""
+        with self._save_lock:
+            # Under the lock so a save in progress never sees the dict change
+            self.config[key] = value
+            if save:
+                self._dirty = True
+                if self._save_timer is None:
+                    self._save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+    
+    def flush(self):
+        """Write pending changes to file now"""
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            # Stay dirty if the write fails so the next flush retries it
+            if self.save_config():
+                self._dirty = False
@@ -7,10 +7,84 @@ Date: 2025-10-25
 """
 
 import spidev
-import RPi.GPIO as GPIO
+try:
+    # lgpio drives the pins through the gpiochip device, much cheaper per write
+    import lgpio
+    LGPIO_AVAILABLE = True
+except ImportError:
+    import RPi.GPIO as GPIO
+    LGPIO_AVAILABLE = False
+import os
 import time
 import math
-from PIL import Image, ImageDraw, ImageFont
+import queue
+import threading
+import functools
+from PIL import Image, ImageDraw, ImageFont, ImageChops
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    print("⚠️ NumPy not available - using PIL RGB565 conversion")
+    NUMPY_AVAILABLE = False
+
+# TrueType fonts in order of preference
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/droid/DroidSans.ttf"
+]
+FONT_SIZES = (8, 9, 10, 12, 14, 16, 20, 24)
+
+@functools.lru_cache(maxsize=None)
+def _font_path():
+    """First loadable TrueType font path (None if none installed)"""
+    for font_path in FONT_PATHS:
+        try:
+            ImageFont.truetype(font_path, 10)
+            return font_path
+        except OSError:
+            continue
+    return None
+
+@functools.lru_cache(maxsize=None)
+def _load_font(size):
+    """Load font once per size, shared by all display instances"""
+    if size not in FONT_SIZES:
+        size = 10
+    font_path = _font_path()
+    if font_path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(font_path, size)
+
+def _spidev_bufsiz():
+    """Largest single spidev transfer (kernel module parameter, default 4096)"""
+    try:
+        with open('/sys/module/spidev/parameters/bufsiz') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 4096
+
+@functools.lru_cache(maxsize=256)
+def _render_text(text, font):
+    """Rasterize text once into an 'L' coverage mask and its offset from the anchor"""
+    left, top, right, bottom = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((0, 0), text, font=font)
+    mask = Image.new('L', (max(1, right - left), max(1, bottom - top)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+    return mask, left, top
+
+@functools.lru_cache(maxsize=16)
+def _solid_rgb565(color, pixel_count):
+    """Pre-packed RGB565 bytes for a solid color fill"""
+    r, g, b = color[:3]
+    rgb565 = ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+    return rgb565.to_bytes(2, 'big') * pixel_count
+
+# Per-band lookup tables for RGB565 packing with PIL (high byte / low byte)
+_R_HI_LUT = [v & 0xF8 for v in range(256)]
+_G_HI_LUT = [v >> 5 for v in range(256)]
+_G_LO_LUT = [(v << 3) & 0xE0 for v in range(256)]
+_B_LO_LUT = [v >> 3 for v in range(256)]
 
 class ST7735Display:
     def __init__(self):
@@ -27,70 +101,81 @@ class ST7735Display:
         # Initialize SPI
         self.spi = spidev.SpiDev()
         self.spi.open(0, 0)  # Bus 0, Device 0 (CE0)
-        self.spi.max_speed_hz = 8000000  # 8MHz for fast updates
-        self.spi.mode = 0
+        # ST7735S runs reliably at 24MHz on the Pi Zero (drop to 16MHz
+        # if the picture shows noise with long jumper wires)
+        self.spi.max_speed_hz = 24000000
+        self.spi.mode = 0  # CPOL=0, CPHA=0 as required by ST7735S
+        # Pixel data is written straight to the spidev fd: a plain write()
+        # per bufsiz chunk, with the GIL released. Full frames are a single
+        # write when spidev.bufsiz=65536 is set (see optimize_boot.sh)
+        try:
+            self._spi_fd = self.spi.fileno()
+        except AttributeError:
+            self._spi_fd = None  # Old spidev without fileno(), use writebytes2
+        self._spi_bufsiz = _spidev_bufsiz()
         
         # Initialize GPIO
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(self.DC_PIN, GPIO.OUT)
-        GPIO.setup(self.RST_PIN, GPIO.OUT)
+        if LGPIO_AVAILABLE:
+            self._gpio_chip = lgpio.gpiochip_open(0)
+            lgpio.gpio_claim_output(self._gpio_chip, self.DC_PIN)
+            lgpio.gpio_claim_output(self._gpio_chip, self.RST_PIN)
+        else:
+            self._gpio_chip = None
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setwarnings(False)
+            GPIO.setup(self.DC_PIN, GPIO.OUT)
+            GPIO.setup(self.RST_PIN, GPIO.OUT)
+        
+        # Last D/C level and RAM window sent, to skip redundant writes
+        self._dc_level = None
+        self._window = None
         
         # Create image buffer
         self.image = Image.new('RGB', (self.WIDTH, self.HEIGHT), (0, 0, 0))
         self.draw = ImageDraw.Draw(self.image)
         
-        # Font cache
-        self.fonts = {}
-        self.load_fonts()
+        # Dirty rectangle (x0, y0, x1, y1 inclusive) waiting to be sent
+        self._dirty = None
+        
+        # Packed RAM writes go out on a worker thread so the next frame can be
+        # drawn while the last one is still on the wire (one queued, one sending)
+        self._tx_queue = queue.Queue(maxsize=1)
+        self._tx_thread = threading.Thread(target=self._tx_worker, daemon=True)
+        self._tx_thread.start()
+        
+        # RGB565 conversion buffers (allocated once, reused every frame)
+        if NUMPY_AVAILABLE:
+            pixel_count = self.WIDTH * self.HEIGHT
+            self._lanes = np.empty(pixel_count, dtype=np.uint32)
+            self._lanes_tmp = np.empty(pixel_count, dtype=np.uint32)
+            # Wire buffers packed in place; three so the one being filled is never
+            # the one queued or the one still being sent by the transfer thread
+            self._tx_buffers = [bytearray(pixel_count * 2) for _ in range(3)]
+            self._tx_words = [np.frombuffer(buf, dtype='<u2') for buf in self._tx_buffers]
+            self._tx_next = 0
+        
+        # Fonts are loaded lazily by _load_font()
+        self.font_path = _font_path()
+        if self.font_path:
+            print(f"✅ Using fonts from {self.font_path}")
+        else:
+            print("⚠️ Using default font (install ttf fonts for better display)")
         
         print("📺 ST7735S Display driver initialized")
     
-    def load_fonts(self):
-        """Load and cache fonts of different sizes"""
-        font_paths = [
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-            "/usr/share/fonts/truetype/droid/DroidSans.ttf"
-        ]
-        
-        # Try to load TrueType fonts
-        font_loaded = False
-        for font_path in font_paths:
-            try:
-                self.fonts = {
-                    8: ImageFont.truetype(font_path, 8),
-                    9: ImageFont.truetype(font_path, 9),
-                    10: ImageFont.truetype(font_path, 10),
-                    12: ImageFont.truetype(font_path, 12),
-                    14: ImageFont.truetype(font_path, 14),
-                    16: ImageFont.truetype(font_path, 16),
-                    20: ImageFont.truetype(font_path, 20),
-                    24: ImageFont.truetype(font_path, 24)
-                }
-                print(f"✅ Loaded fonts from {font_path}")
-                font_loaded = True
-                break
-            except OSError:
-                continue
-        
-        # Fallback to default font
-        if not font_loaded:
-            default_font = ImageFont.load_default()
-            self.fonts = {size: default_font for size in [8, 9, 10, 12, 14, 16, 20, 24]}
-            print("⚠️ Using default font (install ttf fonts for better display)")
-    
     def init_display(self):
         """Initialize ST7735S display with proper command sequence"""
         print("🔧 Initializing ST7735S display...")
+        self.wait_for_transfers()
         
         # Hardware reset sequence
-        GPIO.output(self.RST_PIN, GPIO.HIGH)
+        self._write_pin(self.RST_PIN, 1)
         time.sleep(0.01)
-        GPIO.output(self.RST_PIN, GPIO.LOW)
+        self._write_pin(self.RST_PIN, 0)
         time.sleep(0.01)
-        GPIO.output(self.RST_PIN, GPIO.HIGH)
+        self._write_pin(self.RST_PIN, 1)
         time.sleep(0.12)
+        self._window = None
         
         # Software reset
         self._send_command(0x01)  # SWRESET
@@ -157,24 +242,64 @@ class ST7735Display:
         
         print("✅ ST7735S display ready (128x128 @ 16-bit color)")
     
+    def _write_pin(self, pin, level):
+        """Set output pin level (1 = high, 0 = low)"""
+        if self._gpio_chip is not None:
+            lgpio.gpio_write(self._gpio_chip, pin, level)
+        else:
+            GPIO.output(pin, GPIO.HIGH if level else GPIO.LOW)
+    
+    def _set_dc(self, level):
+        """Set D/C line, skipping the write if it is already at that level"""
+        if level != self._dc_level:
+            self._write_pin(self.DC_PIN, level)
+            self._dc_level = level
+    
     def _send_command(self, cmd, data=None):
         """Send command to ST7735S"""
-        GPIO.output(self.DC_PIN, GPIO.LOW)  # Command mode
-        self.spi.xfer2([cmd])
+        # Write-only: xfer2 would also clock back and build a reply list
+        self._set_dc(0)  # Command mode
+        self._spi_write(bytes((cmd,)))
         
         if data:
-            GPIO.output(self.DC_PIN, GPIO.HIGH)  # Data mode
-            self.spi.xfer2(data)
+            self._set_dc(1)  # Data mode
+            self._spi_write(bytes(data))
     
     def _send_data(self, data):
-        """Send data to ST7735S"""
-        GPIO.output(self.DC_PIN, GPIO.HIGH)  # Data mode
-        
-        # Send data in chunks for better performance
-        chunk_size = 4096
-        for i in range(0, len(data), chunk_size):
-            chunk = data[i:i + chunk_size]
-            self.spi.xfer2(chunk)
+        """Send data buffer (bytes/bytearray/memoryview) to ST7735S"""
+        self._set_dc(1)  # Data mode
+        self._spi_write(data)
+    
+    def _spi_write(self, data):
+        """Write a buffer to the SPI bus (half duplex, nothing read back)"""
+        if self._spi_fd is None:
+            # writebytes2 splits to bufsiz internally
+            self.spi.writebytes2(data)
+            return
+        
+        view = memoryview(data)
+        step = self._spi_bufsiz
+        for start in range(0, len(view), step):
+            os.write(self._spi_fd, view[start:start + step])
+    
+    def _mark_dirty(self, x0, y0, x1, y1):
+        """Grow the dirty rectangle to include the given area"""
+        x0 = max(0, int(x0))
+        y0 = max(0, int(y0))
+        x1 = min(self.WIDTH - 1, int(x1))
+        y1 = min(self.HEIGHT - 1, int(y1))
+        if x0 > x1 or y0 > y1:
+            return
+        
+        if self._dirty:
+            dx0, dy0, dx1, dy1 = self._dirty
+            self._dirty = (min(x0, dx0), min(y0, dy0), max(x1, dx1), max(y1, dy1))
+        else:
+            self._dirty = (x0, y0, x1, y1)
+    
+    def mark_dirty(self):
+        """Force the next update() to send the whole frame"""
+        self._mark_dirty(0, 0, self.WIDTH - 1, self.HEIGHT - 1)
     
     def clear(self, color=(0, 0, 0)):
         """Clear display buffer with specified color"""
@@ -183,12 +308,14 @@ class ST7735Display:
         else:
             fill_color = (0, 0, 0)
         
-        self.draw.rectangle([(0, 0), (self.WIDTH, self.HEIGHT)], fill=fill_color)
+        # paste() with a color is a plain buffer fill, cheaper than drawing a rectangle
+        self.image.paste(fill_color, (0, 0, self.WIDTH, self.HEIGHT))
+        self.mark_dirty()
     
     def draw_text(self, text, x, y, color=(255, 255, 255), size=10, font=None):
         """Draw text with specified font size and color"""
         if font is None:
-            font = self.fonts.get(size, self.fonts.get(10))
+            font = _load_font(size)
         
         # Handle color formats
         if isinstance(color, tuple) and len(color) >= 3:
@@ -196,7 +323,18 @@ class ST7735Display:
         else:
             text_color = (255, 255, 255)  # Default white
         
-        self.draw.text((int(x), int(y)), str(text), font=font, fill=text_color)
+        x, y, text = int(x), int(y), str(text)
+        try:
+            mask, left, top = _render_text(text, font)
+        except ValueError:
+            # Older Pillow cannot measure bitmap fonts - draw directly, assume rest of the row
+            self.draw.text((x, y), text, font=font, fill=text_color)
+            self._mark_dirty(x, y, self.WIDTH - 1, y + size * 2)
+            return
+        
+        # Repeated strings reuse their cached glyph mask: just a blend, no rasterizing
+        self.image.paste(text_color, (x + left, y + top), mask)
+        self._mark_dirty(x + left, y + top, x + left + mask.width - 1, y + top + mask.height - 1)
     
     def draw_rectangle(self, x, y, width, height, color=(255, 255, 255), outline=None):
         """Draw filled rectangle"""
@@ -214,6 +352,7 @@ class ST7735Display:
             outline_color = outline
         
         self.draw.rectangle(coords, fill=fill_color, outline=outline_color)
+        self._mark_dirty(x, y, x + width, y + height)
     
     def draw_circle(self, x, y, radius, color=(255, 255, 255), outline=None):
         """Draw filled circle"""
@@ -225,6 +364,7 @@ class ST7735Display:
             fill_color = (255, 255, 255)
         
         self.draw.ellipse(coords, fill=fill_color, outline=outline)
+        self._mark_dirty(x - radius, y - radius, x + radius, y + radius)
     
     def draw_line(self, x1, y1, x2, y2, color=(255, 255, 255), width=1):
         """Draw line"""
@@ -234,52 +374,137 @@ class ST7735Display:
             line_color = (255, 255, 255)
         
         self.draw.line([(int(x1), int(y1)), (int(x2), int(y2))], fill=line_color, width=int(width))
+        pad = int(width) // 2 + 1
+        self._mark_dirty(min(x1, x2) - pad, min(y1, y2) - pad, max(x1, x2) + pad, max(y1, y2) + pad)
+    
+    def render_sprite(self, width, height, render, background=(0, 0, 0)):
+        """Run drawing calls into an offscreen image for later display_image()"""
+        sprite = Image.new('RGB', (int(width), int(height)), background)
+        image, draw, dirty = self.image, self.draw, self._dirty
+        self.image, self.draw = sprite, ImageDraw.Draw(sprite)
+        try:
+            render()
+        finally:
+            self.image, self.draw, self._dirty = image, draw, dirty
+        return sprite
     
     def display_image(self, img, x=0, y=0):
         """Display PIL image on screen at specified position"""
         if isinstance(img, Image.Image):
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
             self.image.paste(img, (int(x), int(y)))
+            self._mark_dirty(x, y, x + img.width - 1, y + img.height - 1)
         else:
             print("⚠️ Invalid image format")
     
     def update(self):
-        """Update display with current buffer content"""
-        # Convert image to RGB565 format for ST7735S
-        rgb_image = self.image.convert('RGB')
-        pixels = list(rgb_image.getdata())
-        
-        # Convert RGB888 to RGB565
-        rgb565_data = []
-        for pixel in pixels:
-            r, g, b = pixel
-            # Convert to 5-6-5 bit format
-            r565 = (r >> 3) << 11
-            g565 = (g >> 2) << 5
-            b565 = b >> 3
-            rgb565 = r565 | g565 | b565
-            
-            # Split into high and low bytes (big endian)
-            rgb565_data.append((rgb565 >> 8) & 0xFF)
-            rgb565_data.append(rgb565 & 0xFF)
+        """Send the dirty part of the buffer to the display"""
+        if self._dirty is None:
+            return
+        x0, y0, x1, y1 = self._dirty
+        
+        # self.image is always RGB (display_image converts at paste time)
+        rgb_image = self.image
+        if (x1 - x0 + 1, y1 - y0 + 1) != rgb_image.size:
+            rgb_image = rgb_image.crop((x0, y0, x1 + 1, y1 + 1))
+        
+        if NUMPY_AVAILABLE:
+            rgb565_data = self._pack_rgb565(rgb_image)
+        else:
+            rgb565_data = self._pack_rgb565_pil(rgb_image)
+        
+        # The packed data no longer references the image, so drawing can resume at once
+        self._tx_queue.put((self._dirty, rgb565_data))
+        self._dirty = None
+    
+    def _tx_worker(self):
+        """Send queued RAM writes to the panel in order"""
+        while True:
+            job = self._tx_queue.get()
+            try:
+                if job is None:
+                    return
+                self._write_window(*job)
+            except Exception as e:
+                print(f"⚠️ Display transfer error: {e}")
+            finally:
+                self._tx_queue.task_done()
+    
+    def _write_window(self, window, data):
+        """Write RGB565 data into a panel RAM window"""
+        # Limit RAM write to the dirty window (unchanged for full frames)
+        if self._window != window:
+            x0, y0, x1, y1 = window
+            self._send_command(0x2A, [0x00, x0, 0x00, x1])  # CASET
+            self._send_command(0x2B, [0x00, y0, 0x00, y1])  # RASET
+            self._window = window
         
         # Set memory write command
         self._send_command(0x2C)  # RAMWR
         
         # Send pixel data
-        self._send_data(rgb565_data)
+        self._send_data(data)
+    
+    def wait_for_transfers(self):
+        """Block until every queued frame has reached the panel"""
+        self._tx_queue.join()
+    
+    def _pack_rgb565(self, rgb_image):
+        """Vectorized RGB888 to big endian RGB565 conversion"""
+        # One 32-bit lane per pixel (SWAR style): R in bits 0-7,
+        # G in 8-15, B in 16-23 for little endian RGBX
+        count = rgb_image.width * rgb_image.height
+        pixels = np.frombuffer(rgb_image.tobytes('raw', 'RGBX'), dtype='<u4')
+        lanes = self._lanes[:count]
+        tmp = self._lanes_tmp[:count]
+        index = self._tx_next
+        self._tx_next = (index + 1) % len(self._tx_buffers)
+        out = self._tx_words[index][:count]
+        
+        # Build the two wire bytes in place so no byteswap is needed:
+        # low byte = RRRRRGGG (sent first), high byte = GGGBBBBB
+        np.bitwise_and(pixels, 0xF8, out=lanes)       # R[7:3]
+        np.right_shift(pixels, 13, out=tmp)
+        np.bitwise_and(tmp, 0x0007, out=tmp)          # G[7:5]
+        np.bitwise_or(lanes, tmp, out=lanes)
+        np.left_shift(pixels, 3, out=tmp)
+        np.bitwise_and(tmp, 0xE000, out=tmp)          # G[4:2]
+        np.bitwise_or(lanes, tmp, out=lanes)
+        np.right_shift(pixels, 11, out=tmp)
+        np.bitwise_and(tmp, 0x1F00, out=tmp)          # B[7:3]
+        np.bitwise_or(lanes, tmp, out=lanes)
+        
+        np.copyto(out, lanes, casting='unsafe')
+        return memoryview(self._tx_buffers[index])[:count * 2]
+    
+    def _pack_rgb565_pil(self, rgb_image):
+        """RGB565 conversion using PIL band operations (no NumPy)"""
+        # PIL has no RGB -> RGB565 packer, so build both bytes with
+        # per-band lookups. The bit fields never overlap, so add == or.
+        r, g, b = rgb_image.split()
+        high = ImageChops.add(r.point(_R_HI_LUT), g.point(_G_HI_LUT))
+        low = ImageChops.add(g.point(_G_LO_LUT), b.point(_B_LO_LUT))
+        
+        # Interleave as high byte, low byte per pixel
+        return Image.merge('LA', (high, low)).tobytes()
+    
+    def fill_color_fast(self, color):
+        """Fill the panel with a solid color, bypassing the image buffer"""
+        self._tx_queue.put(((0, 0, self.WIDTH - 1, self.HEIGHT - 1),
+                            _solid_rgb565(tuple(color[:3]), self.WIDTH * self.HEIGHT)))
+        
+        # Panel no longer matches the buffer
+        self.mark_dirty()
     
     def flash_screen(self, color=(255, 255, 255), duration=0.2):
         """Flash screen with specified color for camera feedback"""
-        # Save current image
-        original_image = self.image.copy()
-        
-        # Flash with specified color
-        self.clear(color)
-        self.update()
+        # Flash with specified color (image buffer is left untouched)
+        self.fill_color_fast(color)
         time.sleep(duration)
         
         # Restore original image
-        self.image = original_image
+        self.mark_dirty()
         self.update()
     
     def cleanup(self):
@@ -289,11 +514,18 @@ class ST7735Display:
             self.clear()
             self.update()
             
+            # Let the transfer thread finish, then stop it
+            self.wait_for_transfers()
+            self._tx_queue.put(None)
+            self._tx_thread.join(timeout=1)
+            
             # Close SPI
             self.spi.close()
             
             # Reset GPIO pins
-            GPIO.output(self.RST_PIN, GPIO.LOW)
+            self._write_pin(self.RST_PIN, 0)
+            if self._gpio_chip is not None:
+                lgpio.gpiochip_close(self._gpio_chip)
             
             print("🧹 Display cleanup complete")
         except Exception as e:
@@ -9,7 +9,9 @@ Date: 2025-10-25
 import os
 import sys
 import time
+import heapq
 import signal
+import logging
 import threading
 from datetime import datetime
 
@@ -28,12 +30,15 @@ except ImportError as e:
     print("Make sure all files are in the same directory")
     sys.exit(1)
 
+log = logging.getLogger("picam")
+
 class PiCameraLauncher:
     def __init__(self):
         print("🚀 Pi Zero Camera Launcher starting...")
         start_time = time.time()
         
         self.config = Config()
+        log.setLevel(logging.DEBUG if self.config.DEBUG_MODE else logging.WARNING)
         self.running = True
         
         # Initialize display first for immediate feedback
@@ -57,10 +62,30 @@ class PiCameraLauncher:
         print("⚙️ Initializing settings app...")
         self.settings_app = SettingsApp(self.display, self.navigation, self.wifi_manager)
         
+        self.stop_boot_splash()
+        
         # Launcher state
         self.current_screen = "launcher"
         self.selected_app = 0
-        self.last_activity = time.time()
+        self.last_activity = time.monotonic()
+        
+        # Last drawn launcher inputs; None forces a full repaint
+        self._launcher_state = None
+        
+        # Formatted clock strings, keyed by format -> (time slot, text)
+        self._clock_cache = {}
+        
+        # Periodic tasks run from the main loop: heap of (deadline, seq, period, callback)
+        self._tasks = []
+        self._task_seq = 0
+        
+        # Launcher overlay (quick actions / system info) auto-dismiss time
+        self._overlay_until = 0
+        
+        # Pre-rendered static screens (built on first use)
+        self._launcher_frames = None
+        self._sleep_frame = None
+        self._sleep_drawn = None  # Clock text currently on the sleep screen
         
         # App configuration
         self.apps = [
@@ -99,46 +124,77 @@ class PiCameraLauncher:
         self.display.draw_text("PiCamera", 28, 45, color=(255, 255, 255), size=16)
         self.display.draw_text("v1.0", 50, 65, color=(150, 150, 255), size=10)
         
-        # Loading animation
-        for i in range(4):
+        self.display.update()
+        
+        # Loading animation runs while the rest of init carries on
+        self._splash_done = threading.Event()
+        self._splash_thread = threading.Thread(target=self._animate_splash, daemon=True)
+        self._splash_thread.start()
+    
+    def _animate_splash(self):
+        """Animate the loading text until stop_boot_splash() is called"""
+        i = 0
+        while not self._splash_done.is_set():
             loading_text = "Starting" + "." * (i % 4)
-            self.display.draw_text(f"{loading_text}    ", 30, 100, color=(255, 255, 0), size=10)
+            self.display.draw_rectangle(0, 98, 128, 14, color=(0, 0, 50))
+            self.display.draw_text(loading_text, 30, 100, color=(255, 255, 0), size=10)
             self.display.update()
-            time.sleep(0.3)
+            i += 1
+            self._splash_done.wait(0.3)
+    
+    def stop_boot_splash(self):
+        """Stop the loading animation once startup has finished"""
+        self._splash_done.set()
+        self._splash_thread.join(timeout=1)
     
     def start_background_tasks(self):
-        """Start background threads for system tasks"""
-        # Background thread for system monitoring
-        monitor_thread = threading.Thread(target=self.system_monitor, daemon=True)
-        monitor_thread.start()
+        """Schedule periodic system tasks on the main loop (no extra threads)"""
+        self.schedule(self.navigation.poll_held, 0.05)  # Button release/repeat
+        self.schedule(self.system_monitor, 10)  # Check every 10 seconds
     
-    def system_monitor(self):
-        """Background system monitoring"""
-        while self.running:
+    def schedule(self, callback, period):
+        """Run callback from the main loop every period seconds"""
+        self._task_seq += 1
+        heapq.heappush(self._tasks, (time.monotonic() + period, self._task_seq, period, callback))
+    
+    def run_due_tasks(self):
+        """Run every scheduled task whose deadline has passed"""
+        now = time.monotonic()
+        while self._tasks and self._tasks[0][0] <= now:
+            deadline, seq, period, callback = self._tasks[0]
             try:
-                # Check for auto-sleep
-                if time.time() - self.last_activity > self.config.AUTO_SLEEP_TIME:
-                    if self.current_screen == "launcher":
-                        self.show_sleep_screen()
-                
-                time.sleep(10)  # Check every 10 seconds
+                callback()
             except Exception as e:
-                print(f"System monitor error: {e}")
-                time.sleep(30)
+                print(f"⚠️ Scheduled task error: {e}")
+            heapq.heapreplace(self._tasks, (now + period, seq, period, callback))
+    
+    def system_monitor(self):
+        """System monitoring (auto-sleep)"""
+        if time.monotonic() - self.last_activity > self.config.AUTO_SLEEP_TIME:
+            if self.current_screen == "launcher":
+                self.show_sleep_screen()
     
     def run(self):
         """Main application loop"""
         print("🎯 Launcher ready - showing main screen")
         frame_count = 0
+        last_screen = None
+        frame_period = 0.05  # 20 FPS
+        sleep_period = 0.2   # Sleep screen only changes once a second
+        next_frame = time.monotonic()
+        fps_start = next_frame
         
         while self.running:
             try:
-                frame_start = time.time()
+                # Repaint launcher fully whenever we come back to it
+                if self.current_screen != last_screen:
+                    self._launcher_state = None
+                    last_screen = self.current_screen
                 
                 # Handle navigation input
                 nav_input = self.navigation.get_input()
                 if nav_input:
-                    self.last_activity = time.time()
+                    self.last_activity = time.monotonic()
                     self.handle_navigation(nav_input)
                 
                 # Update current screen
@@ -152,16 +208,28 @@ class PiCameraLauncher:
                         self.current_screen = "launcher"
                 elif self.current_screen == "sleep":
                     self.handle_sleep_mode()
+                elif self.current_screen == "overlay":
+                    if time.monotonic() >= self._overlay_until:
+                        self.current_screen = "launcher"
+                
+                # Background work shares this thread
+                self.run_due_tasks()
                 
-                # Frame rate control (20 FPS)
-                frame_time = time.time() - frame_start
-                sleep_time = max(0, 0.05 - frame_time)
-                time.sleep(sleep_time)
+                # Frame rate control: fixed deadlines, so one slow frame
+                # doesn't shift every frame after it
+                next_frame += sleep_period if self.current_screen == "sleep" else frame_period
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame = time.monotonic()
                 
                 frame_count += 1
                 if frame_count % 200 == 0:  # Debug every 10 seconds
-                    fps = 1/(frame_time + sleep_time) if (frame_time + sleep_time) > 0 else 0
-                    print(f"FPS: {fps:.1f}")
+                    now = time.monotonic()
+                    fps = 200 / (now - fps_start) if now > fps_start else 0
+                    fps_start = now
+                    log.debug("FPS: %.1f", fps)
                 
             except Exception as e:
                 print(f"❌ Error in main loop: {e}")
@@ -178,6 +246,9 @@ class PiCameraLauncher:
         elif self.current_screen == "sleep":
             if nav_input:  # Any button wakes up
                 self.current_screen = "launcher"
+        elif self.current_screen == "overlay":
+            if nav_input:  # Any button dismisses
+                self.current_screen = "launcher"
     
     def handle_launcher_navigation(self, nav_input):
         """Handle launcher D-pad navigation"""
@@ -223,34 +294,103 @@ class PiCameraLauncher:
     
     def show_launcher(self):
         """Display Android-style launcher home screen"""
-        self.display.clear((20, 20, 40))  # Dark background
-        
-        # Status bar
-        self.draw_status_bar()
+        # Everything that can change on the launcher between frames
+        state = (self.format_clock(), self.wifi_manager.is_connected(),
+                 self.get_battery_level(), self.selected_app)
+        prev = self._launcher_state
+        if state == prev:
+            return
+        
+        if prev is None:
+            self.display.display_image(self.get_launcher_frames()[self.selected_app][0])
+            self.draw_status_bar(static=False)
+            self.draw_launcher_body(static=False)
+        else:
+            # Only repaint regions whose inputs changed
+            if state[:3] != prev[:3]:
+                self.draw_status_bar()
+            if state[0] != prev[0]:
+                self.draw_launcher_body()
+            elif state[3] != prev[3]:
+                self.draw_selection_change(prev[3])
+        
+        self._launcher_state = state
+        self.display.update()
+    
+    def get_launcher_frames(self):
+        """Pre-render the static launcher once per selectable app
+        
+        Each entry is (full frame, status bar strip, body strip), so repaints
+        are a single paste plus the few dynamic texts.
+        """
+        if self._launcher_frames is None:
+            selected = self.selected_app
+            frames = []
+            try:
+                for i in range(len(self.apps)):
+                    self.selected_app = i
+                    frame = self.display.render_sprite(128, 128, self.draw_launcher_static,
+                                                       background=(20, 20, 40))
+                    frames.append((frame, frame.crop((0, 0, 128, 19)),
+                                   frame.crop((0, 44, 128, 128))))
+            finally:
+                self.selected_app = selected
+            self._launcher_frames = frames
+        return self._launcher_frames
+    
+    def draw_launcher_static(self):
+        """Draw the parts of the launcher that only depend on the selection"""
+        # Status bar background
+        self.display.draw_rectangle(0, 0, 128, 18, color=(10, 10, 30))
         
         # App title
         self.display.draw_text("PiCamera", 25, 25, color=(255, 255, 255), size=16)
         
-        # Current time larger
-        current_time = datetime.now().strftime("%H:%M")
-        self.display.draw_text(current_time, 35, 45, color=(200, 200, 255), size=12)
-        
         # App icons in a grid
         self.draw_app_icons()
         
         # Navigation hints
         self.display.draw_text("◄ ► Select", 5, 108, color=(120, 120, 120), size=8)
         self.display.draw_text("● Open", 75, 108, color=(120, 120, 120), size=8)
+    
+    def icon_box(self, i):
+        """Screen area (x0, y0, x1, y1 exclusive) app icon i can cover, glow included"""
+        # Matches the selected-state rectangles in draw_app_icons()
+        x = 16 + i * 64
+        return (x - 8, 65 - 8, min(128, x + 54), 65 + 46)
+    
+    def draw_selection_change(self, previous):
+        """Repaint just the two icons that changed selection state"""
+        # The glow reaches up under the clock, so its area is restored too
+        # and the clock redrawn once on a clean background
+        boxes = [self.icon_box(previous), self.icon_box(self.selected_app), (30, 44, 80, 62)]
+        box = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+               max(b[2] for b in boxes), max(b[3] for b in boxes))
+        frame = self.get_launcher_frames()[self.selected_app][0]
+        self.display.display_image(frame.crop(box), box[0], box[1])
+        self.draw_launcher_clock()
+    
+    def draw_launcher_clock(self):
+        """Draw the large launcher clock"""
+        current_time = self.format_clock()
+        self.display.draw_text(current_time, 35, 45, color=(200, 200, 255), size=12)
+    
+    def draw_launcher_body(self, static=True):
+        """Draw clock, app icons and hints (everything below the title)"""
+        if static:
+            self.display.display_image(self.get_launcher_frames()[self.selected_app][2], 0, 44)
         
-        self.display.update()
+        # Current time larger
+        self.draw_launcher_clock()
     
-    def draw_status_bar(self):
+    def draw_status_bar(self, static=True):
         """Draw status bar with system info"""
         # Status bar background
-        self.display.draw_rectangle(0, 0, 128, 18, color=(10, 10, 30))
+        if static:
+            self.display.display_image(self.get_launcher_frames()[self.selected_app][1])
         
         # Time (left)
-        current_time = datetime.now().strftime("%H:%M")
+        current_time = self.format_clock()
         self.display.draw_text(current_time, 3, 4, color=(255, 255, 255), size=10)
         
         # WiFi status
@@ -305,7 +445,7 @@ class PiCameraLauncher:
         self.display.draw_text("🔄 Restart", 15, 85, color=(200, 200, 200), size=10)
         
         self.display.update()
-        time.sleep(2)
+        self.show_overlay(2)
     
     def show_system_info(self):
         """Show system information overlay"""
@@ -325,25 +465,47 @@ class PiCameraLauncher:
         self.display.draw_text(f"WiFi: {network[:8]}", 15, 86, color=(200, 200, 200), size=8)
         
         self.display.update()
-        time.sleep(3)
+        self.show_overlay(3)
+    
+    def show_overlay(self, duration):
+        """Keep the drawn overlay up until duration passes or a button is pressed"""
+        # The main loop keeps running; returning to the launcher repaints it
+        self.current_screen = "overlay"
+        self._overlay_until = time.monotonic() + duration
     
     def show_sleep_screen(self):
         """Show sleep/screensaver mode"""
         self.current_screen = "sleep"
+        self._sleep_drawn = None
     
     def handle_sleep_mode(self):
         """Handle sleep mode display"""
-        self.display.clear((0, 0, 0))
+        # Nothing to redraw until the seconds change
+        current_time = self.format_clock("%H:%M:%S", 1)
+        if current_time == self._sleep_drawn:
+            return
+        self._sleep_drawn = current_time
+        
+        if self._sleep_frame is None:
+            # Low power indicator never changes, so render it once
+            self._sleep_frame = self.display.render_sprite(128, 128, lambda: self.display.draw_text(
+                "Press any button", 15, 85, color=(30, 30, 60), size=8))
+        self.display.display_image(self._sleep_frame)
         
         # Dim clock display
-        current_time = datetime.now().strftime("%H:%M:%S")
         self.display.draw_text(current_time, 25, 55, color=(50, 50, 100), size=16)
         
-        # Low power indicator
-        self.display.draw_text("Press any button", 15, 85, color=(30, 30, 60), size=8)
-        
         self.display.update()
     
+    def format_clock(self, fmt="%H:%M", period=60):
+        """Return datetime.now().strftime(fmt), reformatted once per period seconds"""
+        slot = int(time.time() // period)
+        cached = self._clock_cache.get(fmt)
+        if cached is None or cached[0] != slot:
+            cached = (slot, datetime.now().strftime(fmt))
+            self._clock_cache[fmt] = cached
+        return cached[1]
+    
     def get_battery_level(self):
         """Get battery level (placeholder - implement with actual hardware)"""
         # TODO: Implement actual battery monitoring
@@ -363,12 +525,18 @@ class PiCameraLauncher:
     def get_memory_usage(self):
         """Get memory usage percentage"""
         try:
+            total = available = None
             with open('/proc/meminfo', 'r') as f:
-                lines = f.readlines()
-                total = int([line for line in lines if 'MemTotal' in line][0].split()[1])
-                available = int([line for line in lines if 'MemAvailable' in line][0].split()[1])
-                used_percent = int((total - available) / total * 100)
-                return used_percent
+                # Both fields are in the first few lines, stop once they're read
+                for line in f:
+                    if line.startswith('MemTotal:'):
+                        total = int(line.split()[1])
+                    elif line.startswith('MemAvailable:'):
+                        available = int(line.split()[1])
+                    if total is not None and available is not None:
+                        break
+            used_percent = int((total - available) / total * 100)
+            return used_percent
         except:
             return 0
     
@@ -401,6 +569,8 @@ class PiCameraLauncher:
 
 def main():
     """Main entry point with comprehensive error handling"""
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    
     try:
         # Ensure we're in the right directory
         script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -6,10 +6,29 @@ Author: JMTDI
 Date: 2025-10-25
 """
 
-import RPi.GPIO as GPIO
+try:
+    # libgpiod line events: one blocking wait covers every button edge.
+    # Only the v1 API is supported (v2 replaced Chip.get_lines/LineEvent)
+    import gpiod
+    GPIOD_AVAILABLE = hasattr(gpiod, 'LINE_REQ_EV_BOTH_EDGES')
+except ImportError:
+    GPIOD_AVAILABLE = False
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    # Only required when gpiod can't be used
+    if not GPIOD_AVAILABLE:
+        raise
+    GPIO = None
 import time
+import array
+import queue
+import logging
 import threading
 
+# Per-press messages are debug only (see DEBUG_MODE in config.py)
+log = logging.getLogger("picam.navigation")
+
 class NavigationController:
     def __init__(self):
         # GPIO pin assignments for your powered 5-way switch
@@ -26,126 +45,220 @@ class NavigationController:
         self.repeat_delay = 0.5     # 500ms before repeat starts
         self.repeat_rate = 0.1      # 100ms between repeats
         
-        # State tracking
-        self.last_press = {}
-        self.press_count = {}
-        self.button_states = {}
-        self.repeat_active = {}
+        # Button index i owns bit (1 << i) in the state masks
+        self._pin_list = list(self.pins.items())
+        self.pin_bits = {pin: i for i, (_, pin) in enumerate(self._pin_list)}
         
-        # Initialize GPIO
-        self.setup_gpio()
+        # Presses detected by GPIO edge interrupts; _wake cuts wait_for_input's poll short
+        self.events = queue.Queue()
+        self._wake = threading.Event()
+        
+        # State tracking: one bit per button instead of per-direction dicts
+        self.last_press = array.array('d', [0.0] * len(self._pin_list))
+        self.press_count = array.array('i', [0] * len(self._pin_list))
+        self._pressed_mask = 0
+        self._repeat_mask = 0
+        # Edge callbacks (GPIO thread) and poll_held() both update the masks
+        self._state_lock = threading.Lock()
         
-        # Background thread for repeat functionality
+        # Initialize GPIO (use_gpiod drops to False if gpiod setup fails)
         self.running = True
-        self.repeat_thread = threading.Thread(target=self._repeat_handler, daemon=True)
-        self.repeat_thread.start()
+        self.use_gpiod = GPIOD_AVAILABLE
+        self.setup_gpio()
         
         print("🎮 Navigation controller initialized (powered switch)")
     
     def setup_gpio(self):
         """Setup GPIO pins for powered navigation switch"""
+        if self.use_gpiod:
+            try:
+                self.setup_gpiod()
+                return
+            except Exception as e:
+                if GPIO is None:
+                    raise
+                print(f"⚠️ gpiod setup failed ({e}), using RPi.GPIO")
+                self.use_gpiod = False
+                if hasattr(self, '_chip'):
+                    self._chip.close()
+        
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
         
-        # Initialize state tracking
-        for direction in self.pins:
-            self.last_press[direction] = 0
-            self.press_count[direction] = 0
-            self.button_states[direction] = False
-            self.repeat_active[direction] = False
-        
         # Setup pins - NO internal pull-ups needed (switch has VCC)
         for direction, pin in self.pins.items():
             GPIO.setup(pin, GPIO.IN)  # No pull-up needed for powered switch
+            
+            # Kernel-side edge detection with debouncing instead of polling
+            GPIO.add_event_detect(pin, GPIO.RISING, callback=self._on_edge,
+                                  bouncetime=int(self.debounce_time * 1000))
             print(f"📌 {direction}: GPIO {pin}")
         
         print("✅ GPIO setup complete (powered switch mode)")
     
-    def get_input(self):
-        """Get current navigation input with debouncing"""
-        current_time = time.time()
+    def setup_gpiod(self):
+        """Request both-edge line events from the gpiochip device"""
+        self._chip = gpiod.Chip('gpiochip0')
+        self._lines = self._chip.get_lines([pin for _, pin in self._pin_list])
+        self._lines.request(consumer='picam', type=gpiod.LINE_REQ_EV_BOTH_EDGES)
+        self._last_edge = array.array('d', [0.0] * len(self._pin_list))
+        for direction, pin in self._pin_list:
+            print(f"📌 {direction}: GPIO {pin}")
         
-        for direction, pin in self.pins.items():
+        self._event_thread = threading.Thread(target=self._gpiod_worker, daemon=True)
+        self._event_thread.start()
+        print("✅ GPIO setup complete (powered switch mode, gpiod events)")
+    
+    def _gpiod_worker(self):
+        """Sleep in the kernel until any button edge, then dispatch it"""
+        while self.running:
             try:
-                # For powered switch: HIGH = pressed, LOW = not pressed
-                button_pressed = GPIO.input(pin) == GPIO.HIGH
-                
-                # Check for button press
-                if button_pressed and not self.button_states[direction]:
-                    # Button just pressed
-                    if current_time - self.last_press[direction] >= self.debounce_time:
-                        self.last_press[direction] = current_time
-                        self.button_states[direction] = True
-                        self.press_count[direction] = 1
-                        print(f"🎮 Navigation: {direction}")
-                        return direction
-                
-                elif not button_pressed and self.button_states[direction]:
-                    # Button just released
-                    self.button_states[direction] = False
-                    self.repeat_active[direction] = False
-                
-                elif button_pressed and self.button_states[direction]:
-                    # Button held down - check for repeat
-                    hold_time = current_time - self.last_press[direction]
-                    
-                    if hold_time >= self.repeat_delay and not self.repeat_active[direction]:
-                        # Start repeating
-                        self.repeat_active[direction] = True
-                        print(f"🔁 Navigation repeat started: {direction}")
-                        
+                ready = self._lines.event_wait(sec=1)
+                if not ready:
+                    continue
+                for line in ready:
+                    for event in line.event_read_multiple():
+                        self._on_gpiod_event(line, event)
             except Exception as e:
-                print(f"⚠️ GPIO error for {direction}: {e}")
-                continue
+                print(f"⚠️ GPIO event error: {e}")
+                time.sleep(1)
+    
+    def _on_gpiod_event(self, line, event):
+        """Debounce a line event, then treat it as a press or release"""
+        pin = line.offset()
+        i = self.pin_bits.get(pin)
+        if i is None:
+            return
+        
+        timestamp = event.sec + event.nsec / 1e9
+        last_edge = self._last_edge[i]
+        self._last_edge[i] = timestamp
         
-        return None
+        if event.type == gpiod.LineEvent.RISING_EDGE:
+            # libgpiod has no bouncetime, so ignore presses too close to the
+            # last edge (contact bounce on press or release)
+            if timestamp - last_edge >= self.debounce_time:
+                self._on_edge(pin)
+        elif line.get_value() == 0:
+            # Releases are never time-filtered (a quick tap releases within the
+            # debounce window); a bounce mid-press reads high again, so skip it
+            self._release(1 << i)
     
-    def _repeat_handler(self):
-        """Background thread to handle button repeat functionality"""
-        while self.running:
-            current_time = time.time()
+    def _release(self, bit):
+        """Mark a button as released"""
+        with self._state_lock:
+            self._pressed_mask &= ~bit
+            self._repeat_mask &= ~bit
+    
+    def _on_edge(self, channel):
+        """GPIO callback: button pressed (HIGH = pressed for powered switch)"""
+        i = self.pin_bits.get(channel)
+        if i is None:
+            return
+        
+        bit = 1 << i
+        self.last_press[i] = time.time()
+        self.press_count[i] = 1
+        with self._state_lock:
+            self._pressed_mask |= bit
+            self._repeat_mask &= ~bit
+        self.events.put_nowait(self._pin_list[i][0])
+        self._wake.set()
+    
+    def get_input(self):
+        """Get next navigation input (non-blocking)"""
+        try:
+            direction = self.events.get_nowait()
+        except queue.Empty:
+            return None
+        
+        log.debug("🎮 Navigation: %s", direction)
+        return direction
+    
+    def poll_held(self):
+        """Handle button release and repeat (call every ~50ms from the main loop)"""
+        current_time = time.time()
+        
+        # Only pins currently held down need to be read: walk the set bits
+        held = self._pressed_mask
+        while held:
+            lowest = held & -held
+            held ^= lowest
+            i = lowest.bit_length() - 1
+            direction, pin = self._pin_list[i]
+            
+            # gpiod reports releases as falling edges, RPi.GPIO needs a read
+            if not self.use_gpiod:
+                try:
+                    button_pressed = GPIO.input(pin) == GPIO.HIGH
+                except Exception as e:
+                    print(f"⚠️ GPIO error for {direction}: {e}")
+                    continue
+                
+                if not button_pressed:
+                    # Button released
+                    self._release(lowest)
+                    continue
             
-            for direction in self.pins:
-                if (self.repeat_active[direction] and 
-                    self.button_states[direction] and
-                    current_time - self.last_press[direction] >= self.repeat_rate):
-                    
-                    # Generate repeat event
-                    self.last_press[direction] = current_time
-                    self.press_count[direction] += 1
-                    
-                    # Don't flood with repeat events
-                    if self.press_count[direction] % 3 == 0:  # Every 3rd repeat
-                        print(f"🔁 Navigation repeat: {direction}")
+            hold_time = current_time - self.last_press[i]
+            if not self._repeat_mask & lowest:
+                if hold_time >= self.repeat_delay:
+                    # Start repeating
+                    with self._state_lock:
+                        self._repeat_mask |= lowest
+                    log.debug("🔁 Navigation repeat started: %s", direction)
             
-            time.sleep(0.05)  # Check every 50ms
+            elif hold_time >= self.repeat_rate:
+                # Generate repeat event
+                self.last_press[i] = current_time
+                self.press_count[i] += 1
+                
+                # Don't flood with repeat events
+                if self.press_count[i] % 3 == 0:  # Every 3rd repeat
+                    log.debug("🔁 Navigation repeat: %s", direction)
     
     def wait_for_input(self, timeout=None):
         """Wait for navigation input with optional timeout"""
         start_time = time.time()
         
         while True:
+            self._wake.clear()
             input_val = self.get_input()
             if input_val:
                 return input_val
             
-            if timeout and (time.time() - start_time) > timeout:
-                return None
+            remaining = None
+            if timeout:
+                remaining = timeout - (time.time() - start_time)
+                if remaining < 0:
+                    return None
             
-            time.sleep(0.05)
+            self.poll_held()
+            # Held buttons need the 50ms release/repeat poll; otherwise sleep
+            # until a press (or the timeout) - _wake is set by the edge events
+            if self._pressed_mask and (remaining is None or remaining > 0.05):
+                remaining = 0.05
+            self._wake.wait(remaining)
     
     def cleanup(self):
         """Clean up GPIO resources"""
         print("🧹 Cleaning up navigation controller...")
         self.running = False
         
-        # Wait for repeat thread to finish
-        if self.repeat_thread.is_alive():
-            self.repeat_thread.join(timeout=1)
+        if self.use_gpiod:
+            self._event_thread.join(timeout=2)
+            try:
+                self._lines.release()
+                self._chip.close()
+            except Exception as e:
+                print(f"⚠️ GPIO cleanup error: {e}")
+            print("✅ Navigation cleanup complete")
+            return
         
-        # Reset all pins to input
+        # Stop edge detection and reset all pins to input
         for pin in self.pins.values():
             try:
+                GPIO.remove_event_detect(pin)
                 GPIO.setup(pin, GPIO.IN)
             except Exception as e:
                 print(f"⚠️ GPIO cleanup error on pin {pin}: {e}")
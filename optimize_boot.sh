@@ -79,7 +79,8 @@ EOF
 echo "🚀 Optimizing kernel command line..."
 CURRENT_CMDLINE=$(cat /boot/cmdline.txt)
 # Remove console output and add quiet boot options
-NEW_CMDLINE="$CURRENT_CMDLINE quiet splash loglevel=1 logo.nologo vt.global_cursor_default=0"
+# spidev.bufsiz lets a full 32KB display frame go out in a single SPI transfer
+NEW_CMDLINE="$CURRENT_CMDLINE quiet splash loglevel=1 logo.nologo vt.global_cursor_default=0 spidev.bufsiz=65536"
 echo "$NEW_CMDLINE" > /boot/cmdline.txt
 
 # Create systemd optimizations
@@ -8,12 +8,103 @@ Date: 2025-10-25
 
 import os
 import json
+import errno
+import sqlite3
 import time
 import threading
 import shutil
+import collections
 from datetime import datetime
 from pathlib import Path
 
+# sendfile() chunk size when copy_file_range() is unavailable, also the
+# buffer size of the plain read/write fallback
+SENDFILE_CHUNK = 1024 * 1024
+
+# Files counted as photos in the share
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Seconds a share photo count is reused before the folder is scanned again
+COUNT_CACHE_TTL = 2.0
+
+# Upload queue entry fields, stored one column each in the queue database
+QUEUE_FIELDS = ('filepath', 'filename', 'timestamp', 'filesize', 'uploaded',
+                'upload_attempts', 'last_attempt', 'error', 'upload_time',
+                'share_date_path', 'share_all_path')
+
+class _QueueEntry:
+    """One photo in the upload queue (slots, not a dict per photo)"""
+    __slots__ = ('id',) + QUEUE_FIELDS
+    
+    def __init__(self, **fields):
+        # Unknown keys (e.g. from the old JSON queue) are ignored
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+    
+    def values(self):
+        """Field values in QUEUE_FIELDS order, for the database"""
+        return [getattr(self, field) for field in QUEUE_FIELDS]
+
+def _count_photos(folder):
+    """Count photo files in a folder without building a list (0 if missing)"""
+    try:
+        with os.scandir(folder) as entries:
+            return sum(1 for entry in entries if entry.name.lower().endswith(PHOTO_EXTENSIONS))
+    except FileNotFoundError:
+        return 0
+
+# Reused buffer for _readinto_copy (allocated on first use)
+_copy_buffer = None
+
+def _readinto_copy(fsrc, fdst):
+    """Copy the rest of fsrc to fdst through one large reused buffer"""
+    global _copy_buffer
+    if _copy_buffer is None:
+        _copy_buffer = memoryview(bytearray(SENDFILE_CHUNK))
+    while True:
+        n = fsrc.readinto(_copy_buffer)
+        if not n:
+            return
+        fdst.write(_copy_buffer[:n])
+
+def _fast_copy(src, dst):
+    """Copy file data inside the kernel (copy_file_range, then sendfile)
+    
+    Same result as shutil.copyfile(). copy_file_range lets the filesystem
+    reflink or copy server-side where it can.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        remaining = os.fstat(in_fd).st_size
+        if hasattr(os, 'posix_fadvise'):
+            # Whole-file read: let the kernel read ahead aggressively
+            os.posix_fadvise(in_fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        
+        # Both calls advance the file positions, so each fallback
+        # carries on from wherever the previous one stopped
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(in_fd, out_fd, remaining)
+                    if copied == 0:
+                        return
+                    remaining -= copied
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+        
+        try:
+            while True:
+                copied = os.sendfile(out_fd, in_fd, None, SENDFILE_CHUNK)
+                if copied == 0:
+                    return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+        
+        _readinto_copy(fsrc, fdst)
+
 class PhotoUploader:
     def __init__(self, wifi_manager):
         self.wifi_manager = wifi_manager
@@ -27,38 +118,59 @@ class PhotoUploader:
         self.share_base_dir = "/home/pi/camera_share"  # Local share directory
         self.photos_by_date = True  # Organize photos by date
         
-        # Queue management
-        self.upload_queue = []
-        self.queue_file = os.path.expanduser("~/camera/data/upload_queue.json")
+        # Queue management: every entry is persisted row by row in SQLite;
+        # only photos still waiting to be uploaded are kept in memory
+        self.upload_queue = collections.deque()
+        self.queue_db = os.path.expanduser("~/camera/data/upload_queue.db")
+        self.queue_file = os.path.expanduser("~/camera/data/upload_queue.json")  # Old format, imported once
+        self._db = None
         self.processing = False
+        # Status counters kept in step with the queue (see _recount_status)
+        self._count_total = 0
+        self._count_uploaded = 0
+        self._count_failed = 0
+        # Share photo counts: (date_str, count, monotonic time) and (count, monotonic time)
+        self._today_count_cache = (None, 0, 0.0)
+        self._all_count_cache = (0, 0.0)
+        # Photos per by_date folder, scanned once per date then counted up
+        self._daily_counts = {}
+        # by_date folders already created (and chmod'ed) by this process
+        self._created_date_folders = set()
+        # Entries changed since last save; written once per worker pass
+        self._changed = []
+        self._save_lock = threading.Lock()
+        # Set by queue_photo()/cleanup() to wake the worker immediately
+        self._wakeup = threading.Event()
         
-        # Background worker
-        self.running = True
-        self.upload_thread = threading.Thread(target=self._upload_worker, daemon=True)
-        self.upload_thread.start()
+        # Files we create come out 0644 (readable on the share) without a
+        # chmod per file; copies take the source photo's mode via copystat
+        os.umask(0o022)
         
         # Create share directory structure
         self.setup_share_directory()
         
-        # Load existing queue
+        # Load existing queue (before the worker starts using it)
         self.load_queue()
         
+        # Background worker
+        self.running = True
+        self.upload_thread = threading.Thread(target=self._upload_worker, daemon=True)
+        self.upload_thread.start()
+        
         print("📤 Photo uploader initialized (Network Share)")
     
     def setup_share_directory(self):
         """Set up network share directory structure"""
         try:
-            os.makedirs(self.share_base_dir, exist_ok=True)
-            os.makedirs(f"{self.share_base_dir}/by_date", exist_ok=True)
-            os.makedirs(f"{self.share_base_dir}/all_photos", exist_ok=True)
-            
-            # Set permissions for network access
-            os.chmod(self.share_base_dir, 0o755)
-            os.chmod(f"{self.share_base_dir}/by_date", 0o755)
-            os.chmod(f"{self.share_base_dir}/all_photos", 0o755)
+            # Created 0755 for network access (umask 022); makedirs also
+            # creates share_base_dir itself
+            os.makedirs(f"{self.share_base_dir}/by_date", 0o755, exist_ok=True)
+            os.makedirs(f"{self.share_base_dir}/all_photos", 0o755, exist_ok=True)
             
-            # Create info file
-            info_content = f"""PiCamera Photos - {self.device_id}
+            # Create info file (once, not rewritten on every boot)
+            readme_path = f"{self.share_base_dir}/README.txt"
+            if not os.path.exists(readme_path):
+                info_content = f"""PiCamera Photos - {self.device_id}
 Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 Folder Structure:
@@ -67,8 +179,8 @@ Folder Structure:
 
 This folder is shared on the network and accessible from Windows.
 """
-            with open(f"{self.share_base_dir}/README.txt", 'w') as f:
-                f.write(info_content)
+                with open(readme_path, 'w') as f:
+                    f.write(info_content)
             
             print(f"📁 Share directory created: {self.share_base_dir}")
             
@@ -77,170 +189,293 @@ This folder is shared on the network and accessible from Windows.
     
     def queue_photo(self, filepath):
         """Add photo to upload queue"""
-        if not os.path.exists(filepath):
+        try:
+            st = os.stat(filepath)  # One stat for the existence check and the size
+        except FileNotFoundError:
             print(f"❌ Photo not found: {filepath}")
             return False
         
         # Create upload entry
-        photo_info = {
-            'filepath': filepath,
-            'filename': os.path.basename(filepath),
-            'timestamp': datetime.now().isoformat(),
-            'filesize': os.path.getsize(filepath),
-            'uploaded': False,
-            'upload_attempts': 0,
-            'last_attempt': None,
-            'error': None
-        }
+        photo_info = _QueueEntry(
+            filepath=filepath,
+            filename=os.path.basename(filepath),
+            timestamp=datetime.now().isoformat(),
+            filesize=st.st_size,
+            uploaded=False,
+            upload_attempts=0
+        )
         
+        # A single small INSERT instead of rewriting the whole queue; an entry
+        # without a row id could never record its upload status
+        if not self._insert_entries([photo_info]):
+            return False
         self.upload_queue.append(photo_info)
-        self.save_queue()
+        self._count_total += 1
+        self._wakeup.set()
         
-        print(f"📤 Photo queued for upload: {photo_info['filename']}")
+        print(f"📤 Photo queued for upload: {photo_info.filename}")
         return True
     
     def _upload_worker(self):
         """Background worker thread for uploading photos to network share"""
         while self.running:
             try:
-                # Process pending uploads (no need to check WiFi for local share)
-                pending_uploads = [p for p in self.upload_queue if not p['uploaded']]
+                # Process pending uploads (no need to check WiFi for local share).
+                # The queue only holds unfinished photos, so there is nothing to filter;
+                # photos queued during this pass are picked up on the next one
+                retry_needed = False
                 
-                if pending_uploads and not self.processing:
+                if self.upload_queue and not self.processing:
                     self.processing = True
                     
-                    for photo in pending_uploads:
+                    for _ in range(len(self.upload_queue)):
                         if not self.running:
                             break
                         
+                        photo = self.upload_queue.popleft()
                         success = self._upload_single_photo(photo)
                         
                         if success:
-                            photo['uploaded'] = True
-                            photo['upload_time'] = datetime.now().isoformat()
-                            print(f"✅ Uploaded to share: {photo['filename']}")
+                            photo.uploaded = True
+                            photo.upload_time = datetime.now().isoformat()
+                            self._count_uploaded += 1
+                            print(f"✅ Uploaded to share: {photo.filename}")
+                        elif photo.upload_attempts >= self.retry_attempts:
+                            # Out of retries: counted as failed and dropped from memory
+                            self._count_failed += 1
                         else:
-                            # Wait before next attempt
-                            time.sleep(self.retry_delay)
+                            self.upload_queue.append(photo)  # Retried on a later pass
+                            retry_needed = True
                         
-                        self.save_queue()
+                        # Every attempt updates the entry (attempts/error/uploaded)
+                        self._changed.append(photo)
                     
                     self.processing = False
                 
-                time.sleep(5)  # Check every 5 seconds for local share
+                # One save per pass instead of one per photo
+                if self._changed:
+                    self.save_queue()
+                
+                # Sleep until a photo is queued; failed copies are retried after
+                # retry_delay without holding up the rest of the batch
+                self._wakeup.wait(timeout=self.retry_delay if retry_needed else 30)
+                self._wakeup.clear()
                 
             except Exception as e:
                 print(f"❌ Upload worker error: {e}")
                 self.processing = False
-                time.sleep(30)  # Wait longer on error
+                self._wakeup.wait(timeout=30)  # Wait longer on error
+                self._wakeup.clear()
     
     def _upload_single_photo(self, photo_info):
         """Upload a single photo to network share"""
-        filepath = photo_info['filepath']
-        
-        if not os.path.exists(filepath):
-            photo_info['error'] = "File not found"
-            return False
+        filepath = photo_info.filepath
         
         # Check retry limit
-        if photo_info['upload_attempts'] >= self.retry_attempts:
-            photo_info['error'] = "Max retries exceeded"
-            print(f"❌ Max retries exceeded for {photo_info['filename']}")
+        if photo_info.upload_attempts >= self.retry_attempts:
+            photo_info.error = "Max retries exceeded"
+            print(f"❌ Max retries exceeded for {photo_info.filename}")
             return False
         
         try:
-            photo_info['upload_attempts'] += 1
-            photo_info['last_attempt'] = datetime.now().isoformat()
+            now = datetime.now()  # One clock read for the whole attempt
+            photo_info.upload_attempts += 1
+            photo_info.last_attempt = now.isoformat()
             
-            print(f"📤 Copying to share: {photo_info['filename']} (attempt {photo_info['upload_attempts']})...")
+            print(f"📤 Copying to share: {photo_info.filename} (attempt {photo_info.upload_attempts})...")
             
-            # Get photo timestamp for date-based organization
-            photo_timestamp = datetime.fromisoformat(photo_info['timestamp'])
-            date_str = photo_timestamp.strftime('%Y-%m-%d')
+            # Date for date-based organization: the timestamp is ISO format,
+            # so it starts with YYYY-MM-DD and needs no parsing
+            date_str = photo_info.timestamp[:10]
             
-            # Create date folder if it doesn't exist
+            # Create date folder if it doesn't exist (once per date, not per photo)
             date_folder = f"{self.share_base_dir}/by_date/{date_str}"
-            os.makedirs(date_folder, exist_ok=True)
-            os.chmod(date_folder, 0o755)
+            if date_str not in self._created_date_folders:
+                os.makedirs(date_folder, exist_ok=True)
+                os.chmod(date_folder, 0o755)
+                self._created_date_folders.add(date_str)
             
             # Copy to date-organized folder
-            date_dest = f"{date_folder}/{photo_info['filename']}"
-            shutil.copy2(filepath, date_dest)
-            os.chmod(date_dest, 0o644)
+            date_dest = f"{date_folder}/{photo_info.filename}"
+            new_photo = not os.path.exists(date_dest)  # False when re-uploading
+            _fast_copy(filepath, date_dest)
+            shutil.copystat(filepath, date_dest)  # Keep capture time, like copy2
             
-            # Also copy to all_photos folder
-            all_dest = f"{self.share_base_dir}/all_photos/{photo_info['filename']}"
-            shutil.copy2(filepath, all_dest)
-            os.chmod(all_dest, 0o644)
+            # Also add to all_photos folder: a hardlink to the same data
+            # (same filesystem), so the photo is only written to the SD card once
+            all_dest = f"{self.share_base_dir}/all_photos/{photo_info.filename}"
+            if os.path.lexists(all_dest):
+                os.unlink(all_dest)  # Retry of an earlier partial upload
+            try:
+                os.link(date_dest, all_dest)
+            except OSError:
+                try:
+                    # No hardlinks here: an absolute symlink still avoids a second copy
+                    os.symlink(os.path.abspath(date_dest), all_dest)
+                except OSError:
+                    _fast_copy(filepath, all_dest)
+                    shutil.copystat(filepath, all_dest)
             
             # Update photo info
-            photo_info['share_date_path'] = date_dest
-            photo_info['share_all_path'] = all_dest
-            photo_info['error'] = None
+            photo_info.share_date_path = date_dest
+            photo_info.share_all_path = all_dest
+            photo_info.error = None
             
             # Update daily count
-            self._update_daily_count(date_str)
+            self._update_daily_count(date_str, new_photo, now)
+            
+            # Keep cached share counts current without rescanning
+            if new_photo:
+                cached_date, count, checked = self._today_count_cache
+                if cached_date == date_str:
+                    self._today_count_cache = (cached_date, count + 1, checked)
+                count, checked = self._all_count_cache
+                self._all_count_cache = (count + 1, checked)
             
             return True
             
         except Exception as e:
-            photo_info['error'] = str(e)
-            print(f"❌ Upload error for {photo_info['filename']}: {e}")
+            # A missing source photo surfaces here from the copy (no separate stat)
+            if isinstance(e, FileNotFoundError) and e.filename == filepath:
+                photo_info.error = "File not found"
+            else:
+                photo_info.error = str(e)
+            # Folder may have been removed from the share; recreate it on retry
+            self._created_date_folders.clear()
+            print(f"❌ Upload error for {photo_info.filename}: {e}")
             return False
     
-    def _update_daily_count(self, date_str):
+    def _update_daily_count(self, date_str, new_photo=True, now=None):
         """Update daily photo count in date folder"""
         try:
+            if now is None:
+                now = datetime.now()
             date_folder = f"{self.share_base_dir}/by_date/{date_str}"
             
-            # Count photos in this date folder
-            photo_count = len([f for f in os.listdir(date_folder) 
-                             if f.lower().endswith(('.jpg', '.jpeg', '.png'))])
+            # Count photos in this date folder: scan on first use (the scan
+            # already includes the photo just copied), then count up
+            if date_str not in self._daily_counts:
+                self._daily_counts[date_str] = _count_photos(date_folder)
+            elif new_photo:
+                self._daily_counts[date_str] += 1
+            photo_count = self._daily_counts[date_str]
             
             # Create/update count file
             count_file = f"{date_folder}/photos_info.txt"
             count_content = f"""Photos taken on {date_str}
 Total photos: {photo_count}
 Device: {self.device_id}
-Last updated: {datetime.now().strftime('%H:%M:%S')}
+Last updated: {now.strftime('%H:%M:%S')}
 """
             with open(count_file, 'w') as f:
                 f.write(count_content)
-            os.chmod(count_file, 0o644)
             
         except Exception as e:
             print(f"⚠️ Error updating daily count: {e}")
     
+    def _open_db(self):
+        """Open the queue database (WAL, so each change is a small append)"""
+        os.makedirs(os.path.dirname(self.queue_db), exist_ok=True)
+        # Used from the camera's save thread, the worker and cleanup (under _save_lock)
+        db = sqlite3.connect(self.queue_db, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""CREATE TABLE IF NOT EXISTS photos (
+            id INTEGER PRIMARY KEY,
+            filepath TEXT, filename TEXT, timestamp TEXT, filesize INTEGER,
+            uploaded INTEGER, upload_attempts INTEGER, last_attempt TEXT, error TEXT,
+            upload_time TEXT, share_date_path TEXT, share_all_path TEXT)""")
+        db.commit()
+        return db
+    
+    def _insert_entries(self, entries):
+        """Add queue entries to the database, setting their id (False if not saved)"""
+        with self._save_lock:
+            try:
+                for entry in entries:
+                    cursor = self._db.execute(
+                        f"INSERT INTO photos ({', '.join(QUEUE_FIELDS)}) "
+                        f"VALUES ({', '.join('?' * len(QUEUE_FIELDS))})",
+                        entry.values())
+                    entry.id = cursor.lastrowid
+                self._db.commit()
+            except Exception as e:
+                print(f"❌ Error saving upload queue: {e}")
+                for entry in entries:
+                    entry.id = None
+                try:
+                    self._db.rollback()
+                except Exception:
+                    pass
+                return False
+        return True
+    
     def load_queue(self):
-        """Load upload queue from file"""
+        """Load the photos still waiting for upload from the database"""
         try:
+            self._db = self._open_db()
+            
+            # One-time import of the old JSON queue file
             if os.path.exists(self.queue_file):
                 with open(self.queue_file, 'r') as f:
-                    self.upload_queue = json.load(f)
-                print(f"📤 Loaded {len(self.upload_queue)} items from upload queue")
-            else:
-                self.upload_queue = []
+                    imported = json.load(f)
+                # Keep the JSON file for the next start if the import didn't stick
+                if self._insert_entries([_QueueEntry(**fields) for fields in imported]):
+                    os.replace(self.queue_file, self.queue_file + ".imported")
+            
+            rows = self._db.execute(
+                f"SELECT id, {', '.join(QUEUE_FIELDS)} FROM photos "
+                f"WHERE uploaded = 0 AND upload_attempts < ? ORDER BY id",
+                (self.retry_attempts,)).fetchall()
+            self.upload_queue = collections.deque()
+            for row in rows:
+                entry = _QueueEntry(**dict(zip(('id',) + QUEUE_FIELDS, row)))
+                entry.uploaded = bool(entry.uploaded)
+                self.upload_queue.append(entry)
+            
+            print(f"📤 Loaded {len(self.upload_queue)} pending items from upload queue")
         except Exception as e:
             print(f"❌ Error loading upload queue: {e}")
-            self.upload_queue = []
+            self.upload_queue = collections.deque()
+        self._recount_status()
     
-    def save_queue(self):
-        """Save upload queue to file"""
+    def _recount_status(self):
+        """Rebuild the status counters from the database (after loading it)"""
         try:
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(self.queue_file), exist_ok=True)
-            
-            with open(self.queue_file, 'w') as f:
-                json.dump(self.upload_queue, f, indent=2)
+            total, uploaded, failed = self._db.execute(
+                "SELECT COUNT(*), TOTAL(uploaded), "
+                "TOTAL(uploaded = 0 AND upload_attempts >= ?) FROM photos",
+                (self.retry_attempts,)).fetchone()
         except Exception as e:
-            print(f"❌ Error saving upload queue: {e}")
+            print(f"⚠️ Error counting upload queue: {e}")
+            total, uploaded, failed = len(self.upload_queue), 0, 0
+        self._count_total = int(total)
+        self._count_uploaded = int(uploaded)
+        self._count_failed = int(failed)
+    
+    def save_queue(self):
+        """Write changed queue entries to the database (one UPDATE each)"""
+        with self._save_lock:
+            changed, self._changed = self._changed, []
+            if not changed or self._db is None:
+                return
+            try:
+                self._db.executemany(
+                    f"UPDATE photos SET {', '.join(f + ' = ?' for f in QUEUE_FIELDS)} WHERE id = ?",
+                    [entry.values() + [entry.id]
+                     for entry in {id(entry): entry for entry in changed}.values()])
+                self._db.commit()
+            except Exception as e:
+                self._changed.extend(changed)  # Retry on the next pass
+                print(f"❌ Error saving upload queue: {e}")
     
     def get_upload_status(self):
         """Get upload queue status"""
-        total = len(self.upload_queue)
-        uploaded = len([p for p in self.upload_queue if p['uploaded']])
+        # Counters are updated by the worker, no queue scan needed
+        total = self._count_total
+        uploaded = self._count_uploaded
         pending = total - uploaded
-        failed = len([p for p in self.upload_queue if not p['uploaded'] and p['upload_attempts'] >= self.retry_attempts])
+        failed = self._count_failed
         
         return {
             'total': total,
@@ -253,13 +488,16 @@ Last updated: {datetime.now().strftime('%H:%M:%S')}
     def get_todays_photos(self):
         """Get count of today's photos"""
         today = datetime.now().strftime('%Y-%m-%d')
-        date_folder = f"{self.share_base_dir}/by_date/{today}"
+        cached_date, count, checked = self._today_count_cache
+        now = time.monotonic()
+        if cached_date == today and now - checked < COUNT_CACHE_TTL:
+            return count
         
+        date_folder = f"{self.share_base_dir}/by_date/{today}"
         try:
-            if os.path.exists(date_folder):
-                photos = [f for f in os.listdir(date_folder) 
-                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                return len(photos)
+            count = _count_photos(date_folder)
+            self._today_count_cache = (today, count, now)
+            return count
         except Exception as e:
             print(f"Error counting today's photos: {e}")
         
@@ -267,12 +505,15 @@ Last updated: {datetime.now().strftime('%H:%M:%S')}
     
     def get_total_photos_in_share(self):
         """Get total number of photos in share"""
+        count, checked = self._all_count_cache
+        now = time.monotonic()
+        if checked and now - checked < COUNT_CACHE_TTL:
+            return count
+        
         try:
-            all_folder = f"{self.share_base_dir}/all_photos"
-            if os.path.exists(all_folder):
-                photos = [f for f in os.listdir(all_folder) 
-                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                return len(photos)
+            count = _count_photos(f"{self.share_base_dir}/all_photos")
+            self._all_count_cache = (count, now)
+            return count
         except Exception as e:
             print(f"Error counting total photos: {e}")
         
@@ -282,9 +523,19 @@ Last updated: {datetime.now().strftime('%H:%M:%S')}
         """Clean up uploader"""
         print("🧹 Cleaning up photo uploader...")
         self.running = False
+        self._wakeup.set()
         
         if self.upload_thread.is_alive():
             self.upload_thread.join(timeout=5)
         
         self.save_queue()
+        if self._db is not None:
+            with self._save_lock:
+                try:
+                    # Commits skip fsync (synchronous=NORMAL); sync everything
+                    # into the main database file once, at shutdown
+                    self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                except Exception as e:
+                    print(f"⚠️ Error syncing upload queue: {e}")
+                self._db.close()
         print("✅ Photo uploader cleanup complete")
\ No newline at end of file
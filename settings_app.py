@@ -9,7 +9,35 @@ Date: 2025-10-25
 import time
 import os
 import subprocess
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+
+from photo_uploader import PHOTO_EXTENSIONS
+
+# Local network share written by the photo uploader
+SHARE_PATH = "/home/pi/camera_share"
+
+# Seconds between background refreshes of the share photo counts
+STATS_REFRESH_INTERVAL = 10
+
+# Strongest networks kept from a WiFi scan
+MAX_WIFI_NETWORKS = 12
+
+def _scan_photos(folder, with_size=False):
+    """Count photos in a folder with one scandir pass, optionally totalling their size"""
+    count = total_size = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            name = entry.name
+            # Camera names are already lower case; only fold the rest
+            if name.endswith(PHOTO_EXTENSIONS) or name.lower().endswith(PHOTO_EXTENSIONS):
+                count += 1
+                if with_size:
+                    try:
+                        total_size += entry.stat().st_size
+                    except OSError:
+                        pass
+    return count, total_size
 
 class SettingsApp:
     def __init__(self, display, navigation, wifi_manager):
@@ -93,10 +121,58 @@ class SettingsApp:
             }
         }
         
+        # menu_structure frozen for lookups: name -> (title bar text, items, row
+        # layout), so each access is one dict lookup plus tuple indexing
+        self._menus = {
+            name: ("◄ " + menu["title"] if name != "main" else menu["title"],
+                   tuple(menu["items"]),
+                   tuple(self._menu_row_texts(item) for item in menu["items"]))
+            for name, menu in self.menu_structure.items()
+        }
+        
+        # Menu item action -> handler(item); "info" rows do nothing when selected
+        self._actions = {
+            "submenu": self._open_submenu,
+            "back": lambda item: self.go_back(),
+            "exit": self._exit_app,
+            "scan_wifi": lambda item: self.scan_wifi_networks(),
+            "show_current": lambda item: self.show_current_network(),
+            "show_share_status": lambda item: self.show_share_status(),
+            "show_share_info": lambda item: self.show_share_info(),
+            "show_today_photos": lambda item: self.show_today_photos(),
+            "show_total_photos": lambda item: self.show_total_photos(),
+            "restart": lambda item: self.restart_system(),
+            "shutdown": lambda item: self.shutdown_system(),
+            "show_info": lambda item: self.show_system_info(item["key"]),
+        }
+        
+        # Static background, title bar and hint line per screen (see _chrome)
+        self._chrome_cache = {}
+        
+        # Share folder scans: folder -> (st_mtime_ns, sized, count, total_size).
+        # Adding or removing a photo changes the folder's mtime
+        self._photo_cache = {}
+        # Counts published by the background refresher for the share screens:
+        # {'date': ..., 'today': (count, size) or None, 'total': ...}
+        self._share_stats = {}
+        self._stats_wakeup = threading.Event()
+        self._stats_thread = None
+        # (date string, by_date folder, day start, day end) for _today()
+        self._today_cache = (None, None, 0.0, 0.0)
+        # /proc/uptime, opened on first use and re-read with pread()
+        self._uptime_fd = None
+        
+        # Reboot/shutdown command while its message is on screen
+        self._power_process = None
+        
         # WiFi networks
         self.wifi_networks = []
         self.wifi_selected = 0
         
+        # What run_frame last drew; nothing is redrawn while it still matches.
+        # Reset to None whenever something else has painted the screen
+        self._drawn = None
+        
         print("⚙️ Settings app initialized")
     
     def on_launch(self):
@@ -106,6 +182,60 @@ class SettingsApp:
         self.current_menu = "main"
         self.selected_item = 0
         self.should_exit_flag = False
+        self._drawn = None
+        self.start_stats_refresher()
+    
+    def start_stats_refresher(self):
+        """Count share photos in the background while settings is open"""
+        if self._stats_thread and self._stats_thread.is_alive():
+            self._stats_wakeup.set()
+            return
+        self._stats_thread = threading.Thread(target=self._stats_worker, daemon=True)
+        self._stats_thread.start()
+    
+    def _stats_worker(self):
+        """Refresh share photo counts until the app exits"""
+        while self.running and not self.should_exit_flag:
+            self._refresh_share_stats()
+            self._stats_wakeup.wait(timeout=STATS_REFRESH_INTERVAL)
+            self._stats_wakeup.clear()
+    
+    def _refresh_share_stats(self):
+        """Scan the share folders and publish the results in one assignment"""
+        today, today_folder = self._today()
+        stats = {'date': today}
+        for key, folder, with_size in (("today", today_folder, False),
+                                       ("total", f"{SHARE_PATH}/all_photos", True)):
+            try:
+                stats[key] = self._photo_stats(folder, with_size)
+            except FileNotFoundError:
+                stats[key] = None
+            except Exception as e:
+                print(f"⚠️ Error counting share photos: {e}")
+                stats[key] = None
+        self._share_stats = stats
+    
+    def _share_stat(self, key):
+        """Last published counts for 'today'/'total' as (ready, (count, size) or None)"""
+        # Entering a share screen asks for a fresh count for next time
+        self._stats_wakeup.set()
+        stats = self._share_stats
+        if stats.get('date') != self._today()[0]:
+            return False, None  # First scan (or today's) still running
+        return True, stats[key]
+    
+    def _today(self):
+        """Today's date string and by_date folder, formatted once per day"""
+        now = time.time()
+        date_str, folder, start, end = self._today_cache
+        if not start <= now < end:  # New day (or the clock was set)
+            today = datetime.now()
+            date_str = today.strftime('%Y-%m-%d')
+            folder = f"{SHARE_PATH}/by_date/{date_str}"
+            midnight = today.replace(hour=0, minute=0, second=0, microsecond=0)
+            self._today_cache = (date_str, folder, midnight.timestamp(),
+                                 (midnight + timedelta(days=1)).timestamp())
+        return date_str, folder
     
     def run_frame(self):
         """Update settings app (called every frame)"""
@@ -113,19 +243,21 @@ class SettingsApp:
             return False
         
         # Show current menu
-        if self.current_menu in self.menu_structure:
+        if self.current_menu in self._menus:
             self.show_menu(self.current_menu)
         elif self.current_menu == "wifi_scan":
             self.show_wifi_scan()
         elif self.current_menu == "wifi_networks":
             self.show_wifi_networks()
+        elif self.current_menu == "power":
+            self.check_power_command()
         
-        self.display.update()
+        self.display.update()  # No-op when nothing was redrawn
         return not self.should_exit_flag
     
     def handle_input(self, nav_input):
         """Handle settings app input"""
-        if self.current_menu in self.menu_structure:
+        if self.current_menu in self._menus:
             self.handle_menu_input(nav_input)
         elif self.current_menu == "wifi_scan":
             self.handle_wifi_scan_input(nav_input)
@@ -134,12 +266,12 @@ class SettingsApp:
     
     def handle_menu_input(self, nav_input):
         """Handle menu navigation input"""
-        menu = self.menu_structure[self.current_menu]
+        items = self._menus[self.current_menu][1]
         
         if nav_input == "UP":
             self.selected_item = max(0, self.selected_item - 1)
         elif nav_input == "DOWN":
-            self.selected_item = min(len(menu["items"]) - 1, self.selected_item + 1)
+            self.selected_item = min(len(items) - 1, self.selected_item + 1)
         elif nav_input == "CENTER":
             self.execute_menu_action()
         elif nav_input == "LEFT":
@@ -148,78 +280,94 @@ class SettingsApp:
     
     def execute_menu_action(self):
         """Execute the action for the selected menu item"""
-        menu = self.menu_structure[self.current_menu]
-        item = menu["items"][self.selected_item]
-        action = item["action"]
+        item = self._menus[self.current_menu][1][self.selected_item]
+        self._drawn = None  # Actions change menus or paint their own screens
         
-        if action == "submenu":
-            self.current_menu = item["submenu"]
-            self.selected_item = 0
-        elif action == "back":
-            self.go_back()
-        elif action == "exit":
-            self.should_exit_flag = True
-        elif action == "scan_wifi":
-            self.scan_wifi_networks()
-        elif action == "show_current":
-            self.show_current_network()
-        elif action == "show_share_status":
-            self.show_share_status()
-        elif action == "show_share_info":
-            self.show_share_info()
-        elif action == "show_today_photos":
-            self.show_today_photos()
-        elif action == "show_total_photos":
-            self.show_total_photos()
-        elif action == "restart":
-            self.restart_system()
-        elif action == "shutdown":
-            self.shutdown_system()
-        elif action == "show_info":
-            self.show_system_info(item["key"])
+        handler = self._actions.get(item["action"])
+        if handler:
+            handler(item)
+    
+    def _open_submenu(self, item):
+        """Menu action: enter the item's submenu"""
+        self.current_menu = item["submenu"]
+        self.selected_item = 0
+    
+    def _exit_app(self, item):
+        """Menu action: leave the settings app"""
+        self.should_exit_flag = True
     
     def show_menu(self, menu_name):
         """Display menu interface"""
-        menu = self.menu_structure[menu_name]
-        self.display.clear((20, 20, 40))
-        
-        # Title bar
-        self.display.draw_rectangle(0, 0, 128, 25, color=(25, 118, 210))
-        title = menu["title"]
-        if menu_name != "main":
-            title = "◄ " + title
-        self.display.draw_text(title, 5, 7, color=(255, 255, 255), size=12)
+        title, _, rows = self._menus[menu_name]
         
-        # Menu items
+        # Menu items: scroll so the selection is the last visible row at most
         visible_items = 4
-        start_item = max(0, min(self.selected_item - visible_items + 1, 
-                               len(menu["items"]) - visible_items))
+        last_start = len(rows) - visible_items
+        start_item = self.selected_item - visible_items + 1
+        if start_item > last_start:
+            start_item = last_start
+        if start_item < 0:
+            start_item = 0
+        
+        prev = self._drawn
+        self._drawn = ("menu", menu_name, start_item, self.selected_item)
+        if prev == self._drawn:
+            return
+        if prev and prev[:3] == self._drawn[:3]:
+            # Only the selection moved: repaint the old and the new row
+            for i in (prev[3], self.selected_item):
+                self._draw_menu_item(rows[i], 30 + (i - start_item) * 22,
+                                     i == self.selected_item)
+            return
+        
+        # Title bar and navigation hint come prerendered; rows are drawn on top
+        self.display.display_image(self._chrome(menu_name, title, "▲▼ Navigate  ● Select"))
         
         y = 30
-        for i in range(start_item, min(len(menu["items"]), start_item + visible_items)):
-            item = menu["items"][i]
-            
-            # Highlight selected item
-            if i == self.selected_item:
-                self.display.draw_rectangle(2, y-2, 124, 20, color=(50, 150, 255))
-            
-            # Icon and text
-            self.display.draw_text(item["icon"], 8, y, color=(255, 255, 255), size=12)
-            self.display.draw_text(item["name"], 28, y, color=(255, 255, 255), size=10)
-            
-            # Show value if present
-            if "value" in item:
-                value = str(item["value"])
-                self.display.draw_text(value, 80, y, color=(200, 200, 200), size=8)
-            
-            # Arrow for submenus
-            if item["action"] in ["submenu", "info"]:
-                self.display.draw_text("►", 115, y, color=(150, 150, 150), size=10)
-            
+        for i, row in enumerate(rows[start_item:start_item + visible_items], start_item):
+            self._draw_menu_item(row, y, i == self.selected_item)
             y += 22
+    
+    @staticmethod
+    def _menu_row_texts(item):
+        """The (text, x, color, size) draws of one menu row, left to right"""
+        # Icon and text
+        texts = [(item["icon"], 8, (255, 255, 255), 12),
+                 (item["name"], 28, (255, 255, 255), 10)]
+        
+        # Show value if present
+        if "value" in item:
+            texts.append((str(item["value"]), 80, (200, 200, 200), 8))
+        
+        # Arrow for submenus
+        if item["action"] in ("submenu", "info"):
+            texts.append(("►", 115, (150, 150, 150), 10))
+        return tuple(texts)
+    
+    def _draw_menu_item(self, row, y, selected):
+        """Draw one menu row over a cleared band (so it can be redrawn alone)"""
+        draw_text = self.display.draw_text
+        self.display.draw_rectangle(0, y-2, 127, 20, color=(20, 20, 40))
+        
+        # Highlight selected item
+        if selected:
+            self.display.draw_rectangle(2, y-2, 124, 20, color=(50, 150, 255))
         
-        # Navigation hint
-        self.display.draw_text("▲▼ Navigate  ● Select", 5, 115, color=(100, 100, 100), size=8)
+        for text, x, color, size in row:
+            draw_text(text, x, y, color=color, size=size)
+    
+    def _chrome(self, key, title, hint=None):
+        """Cleared background, title bar and hint line of a screen, rendered once"""
+        chrome = self._chrome_cache.get(key)
+        if chrome is None:
+            def render():
+                self.display.draw_rectangle(0, 0, 128, 25, color=(25, 118, 210))
+                self.display.draw_text(title, 5, 7, color=(255, 255, 255), size=12)
+                if hint:
+                    self.display.draw_text(hint, 5, 115, color=(100, 100, 100), size=8)
+            chrome = self.display.render_sprite(128, 128, render, background=(20, 20, 40))
+            self._chrome_cache[key] = chrome
+        return chrome
     
     def scan_wifi_networks(self):
         """Scan for WiFi networks"""
@@ -227,14 +375,23 @@ class SettingsApp:
         self.wifi_networks = []
         
         # Start scan in background
-        import threading
         scan_thread = threading.Thread(target=self._perform_wifi_scan, daemon=True)
         scan_thread.start()
     
     def _perform_wifi_scan(self):
         """Perform WiFi scan in background"""
         try:
-            self.wifi_networks = self.wifi_manager.scan_networks()
+            # Results come strongest first: keep one entry per named SSID,
+            # and only as many as are worth scrolling through
+            networks, seen = [], set()
+            for network in self.wifi_manager.scan_networks():
+                ssid = network.get('ssid')
+                if ssid and ssid not in seen:
+                    seen.add(ssid)
+                    networks.append(network)
+                    if len(networks) == MAX_WIFI_NETWORKS:
+                        break
+            self.wifi_networks = networks
             if self.wifi_networks:
                 self.current_menu = "wifi_networks"
                 self.wifi_selected = 0
@@ -248,34 +405,42 @@ class SettingsApp:
     
     def show_wifi_scan(self):
         """Show WiFi scanning screen"""
-        self.display.clear((20, 20, 40))
-        
-        self.display.draw_rectangle(0, 0, 128, 25, color=(25, 118, 210))
-        self.display.draw_text("◄ Scanning WiFi", 5, 7, color=(255, 255, 255), size=12)
-        
-        # Scanning animation
+        # Scanning animation: only changes a few times a second
         dots = "." * ((int(time.time() * 3) % 4))
-        self.display.draw_text(f"Scanning{dots}    ", 30, 60, color=(255, 255, 255), size=12)
+        prev, self._drawn = self._drawn, ("wifi_scan", dots)
+        if prev == self._drawn:
+            return
         
-        # Cancel hint
-        self.display.draw_text("◄ Cancel", 5, 115, color=(100, 100, 100), size=8)
+        # Title bar and cancel hint are prerendered
+        self.display.display_image(self._chrome("wifi_scan", "◄ Scanning WiFi", "◄ Cancel"))
+        self.display.draw_text(f"Scanning{dots}    ", 30, 60, color=(255, 255, 255), size=12)
     
     def show_wifi_networks(self):
         """Show available WiFi networks"""
-        self.display.clear((20, 20, 40))
-        
-        self.display.draw_rectangle(0, 0, 128, 25, color=(25, 118, 210))
-        self.display.draw_text("◄ WiFi Networks", 5, 7, color=(255, 255, 255), size=12)
+        # The scan thread replaces the list, so its identity tells us it changed
+        prev = self._drawn
+        self._drawn = ("wifi_networks", id(self.wifi_networks), self.wifi_selected)
+        if prev == self._drawn:
+            return
         
         if not self.wifi_networks:
+            self.display.display_image(self._chrome("wifi_networks_empty", "◄ WiFi Networks"))
             self.display.draw_text("No networks found", 15, 60, color=(255, 100, 100), size=10)
             return
         
+        # Title bar and back/connect hint are prerendered
+        self.display.display_image(
+            self._chrome("wifi_networks", "◄ WiFi Networks", "◄ Back  ● Connect"))
+        
         # Show networks
         y = 35
         visible_networks = 3
-        start_net = max(0, min(self.wifi_selected - visible_networks + 1,
-                              len(self.wifi_networks) - visible_networks))
+        last_start = len(self.wifi_networks) - visible_networks
+        start_net = self.wifi_selected - visible_networks + 1
+        if start_net > last_start:
+            start_net = last_start
+        if start_net < 0:
+            start_net = 0
         
         for i in range(start_net, min(len(self.wifi_networks), start_net + visible_networks)):
             network = self.wifi_networks[i]
@@ -295,8 +460,6 @@ class SettingsApp:
                 self.display.draw_text("🔒", 110, y, color=(255, 255, 0), size=8)
             
             y += 20
-        
-        self.display.draw_text("◄ Back  ● Connect", 5, 115, color=(100, 100, 100), size=8)
     
     def handle_wifi_scan_input(self, nav_input):
         """Handle WiFi scan input"""
@@ -317,6 +480,7 @@ class SettingsApp:
     def connect_to_wifi(self):
         """Connect to selected WiFi network"""
         if self.wifi_networks and self.wifi_selected < len(self.wifi_networks):
+            self._drawn = None  # Connection screens replace the menu
             network = self.wifi_networks[self.wifi_selected]
             ssid = network.get('ssid')
             
@@ -370,18 +534,15 @@ class SettingsApp:
         self.display.draw_text("Network Share", 20, 30, color=(255, 255, 255), size=12)
         
         # Check if share is accessible
-        share_path = "/home/pi/camera_share"
-        if os.path.exists(share_path):
+        if os.path.exists(SHARE_PATH):
             self.display.draw_text("Status: Active", 15, 50, color=(0, 255, 0), size=10)
             
-            # Get today's photos count
-            today = datetime.now().strftime('%Y-%m-%d')
-            today_folder = f"{share_path}/by_date/{today}"
-            today_count = 0
-            if os.path.exists(today_folder):
-                photos = [f for f in os.listdir(today_folder) 
-                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                today_count = len(photos)
+            # Get today's photos count (counted in the background)
+            ready, counts = self._share_stat("today")
+            if not ready:
+                today_count = "..."
+            else:
+                today_count = counts[0] if counts else 0
             
             self.display.draw_text(f"Today: {today_count}", 15, 65, color=(255, 255, 255), size=10)
         else:
@@ -418,18 +579,16 @@ class SettingsApp:
     
     def show_today_photos(self):
         """Show today's photo count"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        share_path = "/home/pi/camera_share"
-        today_folder = f"{share_path}/by_date/{today}"
+        today = self._today()[0]
+        ready, counts = self._share_stat("today")
         
         self.display.clear()
         self.display.draw_text("Today's Photos", 20, 35, color=(255, 255, 255), size=12)
         
-        if os.path.exists(today_folder):
-            photos = [f for f in os.listdir(today_folder) 
-                     if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            count = len(photos)
-            self.display.draw_text(f"Count: {count}", 15, 55, color=(0, 255, 0), size=12)
+        if not ready:
+            self.display.draw_text("Counting...", 15, 55, color=(255, 255, 0), size=10)
+        elif counts is not None:
+            self.display.draw_text(f"Count: {counts[0]}", 15, 55, color=(0, 255, 0), size=12)
             self.display.draw_text(f"Date: {today}", 15, 75, color=(200, 200, 200), size=9)
         else:
             self.display.draw_text("No photos today", 15, 55, color=(255, 100, 100), size=10)
@@ -441,25 +600,20 @@ class SettingsApp:
     
     def show_total_photos(self):
         """Show total photo count in share"""
-        share_path = "/home/pi/camera_share"
-        all_folder = f"{share_path}/all_photos"
+        ready, counts = self._share_stat("total")
         
         self.display.clear()
         self.display.draw_text("Total Photos", 25, 35, color=(255, 255, 255), size=12)
         
-        if os.path.exists(all_folder):
-            photos = [f for f in os.listdir(all_folder) 
-                     if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            count = len(photos)
+        if not ready:
+            self.display.draw_text("Counting...", 15, 55, color=(255, 255, 0), size=10)
+        elif counts is not None:
+            count, total_size = counts
             self.display.draw_text(f"Total: {count}", 15, 55, color=(0, 255, 0), size=12)
             
             # Show space used (approximate)
-            try:
-                total_size = sum(os.path.getsize(f"{all_folder}/{f}") for f in photos)
-                size_mb = total_size / (1024 * 1024)
-                self.display.draw_text(f"Size: {size_mb:.1f}MB", 15, 75, color=(200, 200, 200), size=9)
-            except:
-                pass
+            size_mb = total_size / (1024 * 1024)
+            self.display.draw_text(f"Size: {size_mb:.1f}MB", 15, 75, color=(200, 200, 200), size=9)
         else:
             self.display.draw_text("No photos yet", 20, 55, color=(255, 100, 100), size=10)
         
@@ -468,6 +622,17 @@ class SettingsApp:
         
         self.navigation.wait_for_input(timeout=5)
     
+    def _photo_stats(self, folder, with_size=False):
+        """Photo count (and size) of a share folder, rescanned only when it changed"""
+        mtime = os.stat(folder).st_mtime_ns
+        cached = self._photo_cache.get(folder)
+        if cached and cached[0] == mtime and (cached[1] or not with_size):
+            return cached[2], cached[3]
+        
+        count, total_size = _scan_photos(folder, with_size)
+        self._photo_cache[folder] = (mtime, with_size, count, total_size)
+        return count, total_size
+    
     def show_system_info(self, info_type):
         """Show system information"""
         self.display.clear()
@@ -494,10 +659,14 @@ class SettingsApp:
         self.display.clear()
         self.display.draw_text("Restarting...", 25, 60, color=(255, 255, 0), size=12)
         self.display.update()
-        time.sleep(2)
+        self.display.wait_for_transfers()  # Message is on the panel before we go
         
         try:
-            subprocess.run(['sudo', 'reboot'], check=True)
+            # Don't block the UI thread while the system goes down
+            self._power_process = subprocess.Popen(['sudo', 'reboot'],
+                                                   stdout=subprocess.DEVNULL,
+                                                   stderr=subprocess.DEVNULL)
+            self.current_menu = "power"
         except Exception as e:
             print(f"Restart failed: {e}")
     
@@ -506,13 +675,26 @@ class SettingsApp:
         self.display.clear()
         self.display.draw_text("Shutting down...", 15, 60, color=(255, 100, 100), size=12)
         self.display.update()
-        time.sleep(2)
+        self.display.wait_for_transfers()  # Message is on the panel before we go
         
         try:
-            subprocess.run(['sudo', 'shutdown', '-h', 'now'], check=True)
+            # Don't block the UI thread while the system goes down
+            self._power_process = subprocess.Popen(['sudo', 'shutdown', '-h', 'now'],
+                                                   stdout=subprocess.DEVNULL,
+                                                   stderr=subprocess.DEVNULL)
+            self.current_menu = "power"
         except Exception as e:
             print(f"Shutdown failed: {e}")
     
+    def check_power_command(self):
+        """Keep the restart/shutdown message up; return to the menu if the command failed"""
+        returncode = self._power_process.poll()
+        if returncode:
+            print(f"Restart/shutdown failed: exit status {returncode}")
+            self._power_process = None
+            self.current_menu = "system"
+            self._drawn = None
+    
     def go_back(self):
         """Go back to previous menu"""
         if self.current_menu == "main":
@@ -528,15 +710,22 @@ class SettingsApp:
     def get_system_uptime(self):
         """Get system uptime"""
         try:
-            with open('/proc/uptime', 'r') as f:
-                uptime_seconds = float(f.readline().split()[0])
-                hours = int(uptime_seconds // 3600)
-                minutes = int((uptime_seconds % 3600) // 60)
-                return f"{hours}h {minutes}m"
+            if self._uptime_fd is None:
+                self._uptime_fd = os.open('/proc/uptime', os.O_RDONLY)
+            # procfs regenerates the contents on every read from offset 0
+            uptime_seconds = float(os.pread(self._uptime_fd, 64, 0).split(None, 1)[0])
+            hours = int(uptime_seconds // 3600)
+            minutes = int((uptime_seconds % 3600) // 60)
+            return f"{hours}h {minutes}m"
         except:
             return "Unknown"
     
     def cleanup(self):
         """Clean up settings app"""
         print("🧹 Cleaning up settings app...")
-        self.running = False
\ No newline at end of file
+        self.running = False
+        self._stats_wakeup.set()
+        
+        if self._uptime_fd is not None:
+            os.close(self._uptime_fd)
+            self._uptime_fd = None
\ No newline at end of file
@@ -11,20 +11,113 @@ import time
 import json
 import os
 import re
+import select
+import array
+import fcntl
+import hashlib
+import socket
+import struct
 import threading
 from datetime import datetime
 
+INTERFACE = 'wlan0'
+
+# ioctl requests from linux/wireless.h and linux/sockios.h
+SIOCGIWESSID = 0x8B1B
+SIOCGIFADDR = 0x8915
+IW_ESSID_MAX_SIZE = 32
+
+# Route netlink groups/messages (linux/rtnetlink.h) for link and address changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+LINK_EVENTS = (16, 17, 20, 21)  # RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR
+MONITOR_RESYNC = 60  # Re-read the state at least this often without events
+# Nobody has read the state for MONITOR_IDLE seconds: re-read only every MONITOR_DORMANT
+MONITOR_IDLE = 60
+MONITOR_DORMANT = 300
+
+# iwlist scan fields, compiled once instead of looked up per line
+MAC_RE = re.compile(r'Address: ([a-fA-F0-9:]{17})')
+ESSID_RE = re.compile(r'ESSID:"([^"]*)"')
+QUALITY_RE = re.compile(r'Quality=(\d+)/(\d+)')
+SIGNAL_RE = re.compile(r'Signal level=(-?\d+)')
+# A rescan within this many seconds returns the previous results
+SCAN_CACHE_TTL = 10
+
+def _get_essid(sock, ifname):
+    """SSID the interface is associated with ('' if none) - what `iwgetid -r` prints"""
+    essid = array.array('B', bytes(IW_ESSID_MAX_SIZE + 1))
+    # struct iwreq: char ifr_name[16] + struct iw_point {pointer, length, flags}
+    req = struct.pack('16sPHH', ifname.encode(), essid.buffer_info()[0], len(essid), 0)
+    result = fcntl.ioctl(sock.fileno(), SIOCGIWESSID, req.ljust(32, b'\0'))
+    length = struct.unpack_from('16sPHH', result)[2]
+    return essid.tobytes()[:length].rstrip(b'\0').decode('utf-8', 'replace')
+
+def _get_ipv4(sock, ifname):
+    """IPv4 address of the interface, or None while it has none"""
+    try:
+        result = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, struct.pack('256s', ifname.encode()))
+    except OSError:
+        return None
+    # struct ifreq: ifr_name[16] + sockaddr_in {family, port, addr}
+    return socket.inet_ntoa(result[20:24])
+
+def _open_netlink():
+    """Netlink socket subscribed to link/IPv4 address events, or None if unavailable"""
+    try:
+        nl = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        return None
+    try:
+        nl.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+    except OSError:
+        nl.close()
+        return None
+    return nl
+
+def _concerns_interface(data, ifindex):
+    """True if a netlink read holds a link/address message for ifindex (None = any)"""
+    offset = 0
+    while offset + 24 <= len(data):
+        # struct nlmsghdr: length, type, flags, seq, pid
+        length, msg_type = struct.unpack_from('IH', data, offset)
+        if length < 16:
+            break
+        # ifinfomsg and ifaddrmsg both carry the interface index at byte 4
+        if msg_type in LINK_EVENTS and (
+                ifindex is None or struct.unpack_from('i', data, offset + 20)[0] == ifindex):
+            return True
+        offset += (length + 3) & ~3
+    return False
+
+def _stop_scan(proc):
+    """Stop a hung `sudo iwlist` scan"""
+    # SIGTERM is relayed by sudo to iwlist; SIGKILL would only kill sudo
+    # and leave iwlist holding the pipe open
+    proc.terminate()
+    try:
+        proc.wait(timeout=2)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
 class WiFiManager:
     def __init__(self):
         self.config_file = "/etc/wpa_supplicant/wpa_supplicant.conf"
         self.known_networks = []
         self.current_networks = []
+        self._last_scan_ts = 0
         self.connection_status = False
         self.current_network = None
         self.ip_address = None
         
-        # Background monitoring
+        # Background monitoring; readers stamp _last_read so an unwatched
+        # monitor can back off. A byte on the wake socketpair interrupts every
+        # monitor wait (poll sleep, error back-off and the netlink select)
         self.monitoring = True
+        self._last_read = time.monotonic()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
         self.monitor_thread = threading.Thread(target=self._connection_monitor, daemon=True)
         self.monitor_thread.start()
         
@@ -32,86 +125,163 @@ class WiFiManager:
     
     def is_connected(self):
         """Check if WiFi is connected"""
+        self._touch()
         return self.connection_status
     
     def get_current_network(self):
         """Get currently connected network name"""
+        self._touch()
         return self.current_network
     
     def get_ip_address(self):
         """Get current IP address"""
+        self._touch()
         return self.ip_address
     
+    def _touch(self):
+        """Record a read; a dormant monitor re-reads the state right away"""
+        now = time.monotonic()
+        if now - self._last_read >= MONITOR_IDLE:
+            self._wake()
+        self._last_read = now
+    
+    def _monitor_interval(self, active):
+        """Seconds until the next re-read: `active` while the state is being read"""
+        if time.monotonic() - self._last_read < MONITOR_IDLE:
+            return active
+        return MONITOR_DORMANT
+    
+    def _wake(self):
+        """Interrupt whatever the monitor thread is waiting on"""
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass  # Buffer full (a wake-up is already pending) or closed
+    
+    def _drain_wake(self):
+        """Consume pending wake-up bytes"""
+        try:
+            while self._wake_r.recv(64):
+                pass
+        except OSError:
+            pass  # Drained
+    
+    def _sleep(self, seconds):
+        """Sleep that _touch() (dormant wake-up) and cleanup() can interrupt"""
+        if select.select([self._wake_r], [], [], seconds)[0]:
+            self._drain_wake()
+    
     def _connection_monitor(self):
         """Background thread to monitor WiFi connection"""
+        # One socket serves every ioctl: no iwgetid/hostname forks per check
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Kernel link/address events wake the thread; poll only without netlink
+        nl = _open_netlink()
         while self.monitoring:
             try:
                 # Check connection status
-                result = subprocess.run(['iwgetid'], capture_output=True, text=True, timeout=5)
+                try:
+                    network = _get_essid(sock, INTERFACE)
+                except OSError:
+                    network = ''  # No wireless interface, same as iwgetid failing
                 
-                if result.returncode == 0 and result.stdout.strip():
+                if network:
                     # Connected
                     self.connection_status = True
-                    
-                    # Get network name
-                    network_result = subprocess.run(['iwgetid', '-r'], capture_output=True, text=True, timeout=5)
-                    if network_result.returncode == 0:
-                        self.current_network = network_result.stdout.strip()
+                    self.current_network = network
                     
                     # Get IP address
-                    ip_result = subprocess.run(['hostname', '-I'], capture_output=True, text=True, timeout=5)
-                    if ip_result.returncode == 0:
-                        ips = ip_result.stdout.strip().split()
-                        self.ip_address = ips[0] if ips else None
+                    self.ip_address = _get_ipv4(sock, INTERFACE)
                 else:
                     # Not connected
                     self.connection_status = False
                     self.current_network = None
                     self.ip_address = None
                 
-                time.sleep(10)  # Check every 10 seconds
+                if nl is None:
+                    self._sleep(self._monitor_interval(10))  # Check every 10 seconds
+                else:
+                    self._wait_for_link_event(nl)
                 
             except Exception as e:
                 print(f"WiFi monitor error: {e}")
-                time.sleep(30)  # Wait longer on error
+                self._sleep(30)  # Wait longer on error
+        
+        sock.close()
+        if nl is not None:
+            nl.close()
+    
+    def _wait_for_link_event(self, nl):
+        """Block until the kernel reports a change on the interface, or the resync interval passes"""
+        try:
+            ifindex = socket.if_nametoindex(INTERFACE)
+        except OSError:
+            ifindex = None  # Not registered yet: any link event may be its arrival
+        
+        deadline = time.monotonic() + self._monitor_interval(MONITOR_RESYNC)
+        while self.monitoring:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            ready = select.select([nl, self._wake_r], [], [], remaining)[0]
+            if not ready:
+                return  # Resync interval passed
+            if self._wake_r in ready:
+                self._drain_wake()
+                return  # _touch() after a dormant stretch, or cleanup()
+            try:
+                data = nl.recv(65536)
+            except OSError:
+                return  # ENOBUFS after an event burst: resync
+            if _concerns_interface(data, ifindex):
+                return
     
     def scan_networks(self):
         """Scan for available WiFi networks"""
+        if self.current_networks and time.monotonic() - self._last_scan_ts < SCAN_CACHE_TTL:
+            return self.current_networks
+        
         try:
             print("📡 Scanning for WiFi networks...")
             
-            # Trigger scan
-            subprocess.run(['sudo', 'iwlist', 'wlan0', 'scan', 'essid'], 
-                         capture_output=True, text=True, timeout=30)
-            time.sleep(2)
-            
-            # Get scan results
-            result = subprocess.run(['sudo', 'iwlist', 'wlan0', 'scan'], 
-                                  capture_output=True, text=True, timeout=30)
+            # Get scan results (`iwlist scan` triggers a fresh scan and waits for it),
+            # parsing lines as they arrive instead of buffering the whole output
+            proc = subprocess.Popen(['sudo', 'iwlist', 'wlan0', 'scan'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, text=True, bufsize=65536)
+            # Stop a hung scan after 30 s; the pipe then hits EOF and parsing ends
+            watchdog = threading.Timer(30, _stop_scan, args=(proc,))
+            watchdog.start()
+            try:
+                networks = self._parse_scan_results(proc.stdout)
+                stderr = proc.stderr.read()
+                proc.wait()
+            finally:
+                watchdog.cancel()
+                proc.stdout.close()
+                proc.stderr.close()
             
-            if result.returncode == 0:
-                networks = self._parse_scan_results(result.stdout)
+            if proc.returncode == 0:
                 self.current_networks = networks
+                self._last_scan_ts = time.monotonic()
                 print(f"📶 Found {len(networks)} networks")
                 return networks
+            elif proc.returncode < 0:
+                print("WiFi scan timeout")
             else:
-                print(f"WiFi scan failed: {result.stderr}")
+                print(f"WiFi scan failed: {stderr}")
                 
-        except subprocess.TimeoutExpired:
-            print("WiFi scan timeout")
         except Exception as e:
             print(f"WiFi scan error: {e}")
         
         return []
     
-    def _parse_scan_results(self, scan_output):
-        """Parse iwlist scan output into network list"""
+    def _parse_scan_results(self, scan_lines):
+        """Parse iwlist scan output (any iterable of lines) into network list"""
         networks = []
         current_network = {}
         
-        for line in scan_output.split('\n'):
-            line = line.strip()
-            
+        # Substring checks reject most lines before any regex runs
+        for line in scan_lines:
             # New cell (network)
             if 'Cell' in line and 'Address:' in line:
                 if current_network and 'ssid' in current_network:
@@ -119,13 +289,13 @@ class WiFiManager:
                 current_network = {}
                 
                 # Extract MAC address
-                mac_match = re.search(r'Address: ([a-fA-F0-9:]{17})', line)
+                mac_match = MAC_RE.search(line)
                 if mac_match:
                     current_network['mac'] = mac_match.group(1)
             
             # ESSID (network name)
             elif 'ESSID:' in line:
-                essid_match = re.search(r'ESSID:"([^"]*)"', line)
+                essid_match = ESSID_RE.search(line)
                 if essid_match:
                     essid = essid_match.group(1)
                     if essid:  # Skip hidden networks
@@ -133,23 +303,20 @@ class WiFiManager:
             
             # Signal quality
             elif 'Quality=' in line:
-                quality_match = re.search(r'Quality=(\d+)/(\d+)', line)
+                quality_match = QUALITY_RE.search(line)
                 if quality_match:
                     quality = int(quality_match.group(1))
                     max_quality = int(quality_match.group(2))
                     current_network['quality'] = int((quality / max_quality) * 100)
                 
                 # Signal level
-                signal_match = re.search(r'Signal level=(-?\d+)', line)
+                signal_match = SIGNAL_RE.search(line)
                 if signal_match:
                     current_network['signal_level'] = int(signal_match.group(1))
             
-            # Encryption
+            # Encryption ('on' also matches inside "Encryption", so look at the value)
             elif 'Encryption key:' in line:
-                if 'on' in line.lower():
-                    current_network['encrypted'] = True
-                else:
-                    current_network['encrypted'] = False
+                current_network['encrypted'] = 'key:on' in line
         
         # Add last network
         if current_network and 'ssid' in current_network:
@@ -162,47 +329,53 @@ class WiFiManager:
     
     def connect_to_network(self, ssid, password=None, save=True):
         """Connect to a WiFi network"""
+        wpa = None
         try:
             print(f"📶 Connecting to {ssid}...")
             
-            # Add network using wpa_cli
+            # Add network using one interactive wpa_cli session (one fork and
+            # control-socket connect for the whole sequence). SSID and key go in
+            # as hex, so quotes/newlines in them can't inject wpa_cli commands
             commands = [
-                ['sudo', 'wpa_cli', '-i', 'wlan0', 'remove_network', 'all'],
-                ['sudo', 'wpa_cli', '-i', 'wlan0', 'add_network'],
-                ['sudo', 'wpa_cli', '-i', 'wlan0', 'set_network', '0', 'ssid', f'"{ssid}"']
+                'remove_network all',
+                'add_network',
+                f'set_network 0 ssid {ssid.encode().hex()}'
             ]
             
             if password:
-                commands.append(['sudo', 'wpa_cli', '-i', 'wlan0', 'set_network', '0', 'psk', f'"{password}"'])
+                if not 8 <= len(password.encode()) <= 63:
+                    print("❌ WiFi password must be 8-63 characters")
+                    return False
+                # Raw 256-bit PSK, as wpa_passphrase derives it from the passphrase
+                psk = hashlib.pbkdf2_hmac('sha1', password.encode(), ssid.encode(), 4096, 32)
+                commands.append(f'set_network 0 psk {psk.hex()}')
             else:
-                commands.append(['sudo', 'wpa_cli', '-i', 'wlan0', 'set_network', '0', 'key_mgmt', 'NONE'])
+                commands.append('set_network 0 key_mgmt NONE')
             
             commands.extend([
-                ['sudo', 'wpa_cli', '-i', 'wlan0', 'enable_network', '0'],
-                ['sudo', 'wpa_cli', '-i', 'wlan0', 'select_network', '0']
+                'enable_network 0',
+                'select_network 0'
             ])
             
-            # Execute commands
-            for cmd in commands:
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-                if result.returncode != 0:
-                    print(f"Command failed: {' '.join(cmd)}")
-                    print(f"Error: {result.stderr}")
+            # Execute commands; interactive wpa_cli is attached to wpa_supplicant's
+            # event stream, so the same session reports CTRL-EVENT-CONNECTED
+            wpa = subprocess.Popen(['sudo', 'wpa_cli', '-i', 'wlan0'], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            wpa.stdin.write(('\n'.join(commands) + '\n').encode())
+            wpa.stdin.flush()
             
             # Wait for connection
             print("⏳ Waiting for connection...")
-            for attempt in range(30):  # Wait up to 30 seconds
-                time.sleep(1)
-                if self.is_connected() and self.get_current_network() == ssid:
-                    print(f"✅ Connected to {ssid}")
-                    
-                    # Save configuration if requested
-                    if save:
-                        subprocess.run(['sudo', 'wpa_cli', '-i', 'wlan0', 'save_config'], 
-                                     capture_output=True, timeout=10)
-                        print("💾 Network configuration saved")
-                    
-                    return True
+            if self._wait_for_connected(wpa, ssid, timeout=30):
+                print(f"✅ Connected to {ssid}")
+                
+                # Save configuration if requested
+                if save:
+                    wpa.stdin.write(b'save_config\n')
+                    wpa.stdin.flush()
+                    print("💾 Network configuration saved")
+                
+                return True
             
             print(f"❌ Failed to connect to {ssid}")
             return False
@@ -210,13 +383,65 @@ class WiFiManager:
         except Exception as e:
             print(f"❌ Connection error: {e}")
             return False
+        finally:
+            if wpa is not None:
+                self._close_wpa_cli(wpa)
+    
+    def _wait_for_connected(self, wpa, ssid, timeout):
+        """Read wpa_cli output until CTRL-EVENT-CONNECTED; False after timeout seconds"""
+        fd = wpa.stdout.fileno()
+        pending = b''
+        deadline = time.monotonic() + timeout
+        
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            
+            # 1 s slices so the monitor's view still counts if wpa_cli goes quiet
+            if fd is None:
+                time.sleep(min(remaining, 1))
+            elif select.select([fd], [], [], min(remaining, 1))[0]:
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    fd = None  # wpa_cli exited
+                    continue
+                
+                *lines, pending = (pending + chunk).split(b'\n')
+                for line in lines:
+                    if b'CTRL-EVENT-CONNECTED' in line:
+                        return True
+                    if b'FAIL' in line:
+                        print(f"Command failed: {line.decode(errors='replace').strip()}")
+            
+            if self.is_connected() and self.get_current_network() == ssid:
+                return True
+    
+    def _close_wpa_cli(self, wpa):
+        """Quit an interactive wpa_cli session, killing it if it hangs"""
+        try:
+            wpa.stdin.write(b'quit\n')
+            wpa.stdin.close()
+        except OSError:
+            pass  # Already gone
+        
+        try:
+            wpa.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            wpa.kill()
+            wpa.wait()
+        wpa.stdout.close()
     
     def cleanup(self):
         """Clean up WiFi manager"""
         print("🧹 Cleaning up WiFi manager...")
         self.monitoring = False
+        self._wake()
         
         if self.monitor_thread.is_alive():
             self.monitor_thread.join(timeout=2)
+        if not self.monitor_thread.is_alive():
+            self._wake_r.close()
+            self._wake_w.close()
         
         print("✅ WiFi manager cleanup complete")
\ No newline at end of file